@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+# run as a plain script from anywhere: python benchmarks/bench_cardano.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mockchain.blockchain import Wallet
+from mockchain.cardano import Cardano, Value, Output
+
+
+def measure(name, fn, count):
+    start = time.perf_counter()
+    fn(count)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count:>8} ops {elapsed:8.3f}s {count/elapsed:12.0f} ops/s")
+    return elapsed
+
+
+def multi_asset(policies, tokens):
+    value = Value.ADA(5)
+    for j in range(policies):
+        for i in range(tokens):
+            value["policy"+str(j), "token"+str(i)] = 1
+    return value
+
+values = [multi_asset(4, 10) for _ in range(100)]
+
+def run_add(count):
+    for _ in range(count // len(values)):
+        total = Value()
+        for value in values:
+            total = total + value
+
+def run_accumulate(count):
+    for _ in range(count // len(values)):
+        total = Value()
+        for value in values:
+            total.accumulate(value)
+
+def run_ada(count):
+    total = Value.ADA(0)
+    one = Value.ADA(1)
+    for _ in range(count):
+        total = total + one
+
+
+def funded_chain(wallets, utxos):
+    cardano = Cardano(supply=10**12)
+    outputs = [Output(wallets[i % len(wallets)], 1 + (i * 7919) % 1000) for i in range(utxos)]
+    tx = cardano.create_transaction(["genesis:0"], outputs + [Output(cardano.faucet, 10**12 - sum(o.value[("", "ADA")] for o in outputs))])
+    tx.sign(cardano.faucet)
+    cardano.add_transaction(tx)
+    cardano.mine_block()
+    return cardano
+
+def run_selection(strategy):
+    wallets = [Wallet("bench"+str(i)) for i in range(100)]
+    cardano = funded_chain(wallets, 20000)
+
+    def run(count):
+        inputs = 0
+        for i in range(count):
+            inputs += len(cardano.transfer(wallets[i % len(wallets)], wallets[0], 1500, strategy).inputs)
+        print(f"  {strategy}: {inputs/count:.2f} inputs per transfer")
+
+    return run
+
+
+if __name__ == "__main__":
+    add = measure("sum 40-token values (+)", run_add, 100000)
+    accumulate = measure("sum 40-token values (acc)", run_accumulate, 100000)
+    print(f"speedup {add/accumulate:.2f}x")
+    measure("sum ADA-only values", run_ada, 100000)
+
+    for strategy in ["largest-first", "random-improve", "bnb"]:
+        measure("select from 20k UTXOs", run_selection(strategy), 1000)
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+
+# run as a plain script from anywhere: python benchmarks/bench_crypto.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mockchain.crypto import Key, Public, Secret, G, N, generator, hash, verify_batch
+
+
+def measure(name, fn, count):
+    start = time.perf_counter()
+    fn(count)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count:>8} ops {elapsed:8.3f}s {count/elapsed:12.0f} ops/s")
+    return elapsed
+
+
+def plain_publics(count):
+    for _ in range(count):
+        pow(G, Secret.number(), N)
+
+def table_publics(count):
+    for _ in range(count):
+        generator.pow(Secret.number())
+
+def plain_sign(count):
+    key = Key("bench")
+    for i in range(count):
+        h = int(hash(str(i)), 16) % N
+        k = Secret.number()
+        r = pow(G, k, N)
+        s = (k + key.secret * h) % (N-1)
+
+def table_sign(count):
+    key = Key("bench")
+    for i in range(count):
+        key.sign(str(i))
+
+def signed_items(count):
+    keys = [Key("bench"+str(i)) for i in range(100)]
+    return [(keys[i % 100].get_public(), str(i), keys[i % 100].sign(str(i))) for i in range(count)]
+
+def single_verify(items):
+    for public, msg, signature in items:
+        public.check_signature(msg, signature)
+
+def batch_verify(items):
+    Public.signature_cache.clear()
+    for i in range(0, len(items), 500):
+        verify_batch(items[i:i+500])
+
+
+if __name__ == "__main__":
+    generator.build()
+
+    plain = measure("public pow(G, x, N)", plain_publics, 100000)
+    table = measure("public fixed-base", table_publics, 100000)
+    print(f"speedup {plain/table:.2f}x")
+
+    plain = measure("sign pow(G, k, N)", plain_sign, 100000)
+    table = measure("sign fixed-base", table_sign, 100000)
+    print(f"speedup {plain/table:.2f}x")
+
+    items = signed_items(20000)
+    plain = measure("verify one by one", lambda count: single_verify(items), len(items))
+    table = measure("verify_batch (500 per batch)", lambda count: batch_verify(items), len(items))
+    print(f"speedup {plain/table:.2f}x")
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+# run as a plain script from anywhere: python benchmarks/bench_mempool.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mockchain.blockchain import Wallet
+from mockchain.bitcoin import Bitcoin, Output, Script
+
+
+def backlog(blockchain, wallets, count):
+    outputs = [Output(1000, Script.p2pubkey(wallets[i % len(wallets)])) for i in range(count)]
+    funding = blockchain.create_transaction(["genesis:0"], outputs + [Output(blockchain.supply - 1000 * count, Script.p2pubkey(blockchain.faucet))])
+    funding.sign(blockchain.faucet)
+    blockchain.add_transaction(funding)
+    blockchain.mine_block()
+
+    for i, output in enumerate(funding.outputs[:count]):
+        tx = blockchain.create_transaction([output.hash], [Output(1000 - 1 - i % 50, Script.p2pubkey(wallets[0]))])
+        tx.sign(wallets[i % len(wallets)])
+        blockchain.add_transaction(tx)
+
+
+def drain(block_size, count, mempool_count=None):
+    wallets = [Wallet("bench"+str(i)) for i in range(10)]
+    blockchain = Bitcoin(supply=10**9, mempool_count=mempool_count)
+    backlog(blockchain, wallets, count)
+    blockchain.block_size = block_size
+
+    times = []
+    while len(blockchain.mempool) > 0:
+        start = time.perf_counter()
+        blockchain.mine_block()
+        times.append(time.perf_counter() - start)
+
+    label = "unbounded" if block_size is None else str(block_size)+" bytes"
+    if mempool_count is not None:
+        label += ", cap "+str(mempool_count)
+    print(f"block size {label:<24} {count:>6} txs {len(times):>4} blocks  max {max(times)*1000:8.1f} ms/block  total {sum(times):6.2f}s  evicted {blockchain.evictions}")
+
+
+if __name__ == "__main__":
+    drain(None, 5000)
+    drain(100000, 5000)
+    drain(20000, 5000)
+    drain(20000, 5000, mempool_count=1000)
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import tracemalloc
+
+# run as a plain script from anywhere: python benchmarks/bench_program.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mockchain.program import Program
+from mockchain.tracing import Tracer
+
+
+def validator(redeemer, context):
+    if redeemer != "ok":
+        return False
+    return check(redeemer)
+
+def check(redeemer):
+    return len(redeemer) == limit
+
+
+def measure(name, fn, count):
+    start = time.perf_counter()
+    fn(count)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count:>8} ops {elapsed:8.3f}s {count/elapsed:12.0f} ops/s")
+    return elapsed
+
+
+def run_build(count):
+    program = Program.address(validator, check, limit=2).program
+    for _ in range(count):
+        func, env = program.build()
+        func("ok", None)
+
+def run_instance(count):
+    program = Program.address(validator, check, limit=2).program
+    for _ in range(count):
+        program.run("ok", None)
+
+def policy(redeemer, context):
+    tx = context.txinfo
+    minting = tx.mint[(context.policy, "NFT")] > 0
+    if minting and minting_address not in tx.signatories:
+        return False
+    return True
+
+def run_register(count):
+    for i in range(count):
+        Program.address(policy, minting_address="addr"+str(i))
+
+def run_register_uncached(count):
+    for i in range(count):
+        Program.source_cache.clear()
+        Program.codehash_cache.clear()
+        Program.address(policy, minting_address="addr"+str(i))
+
+def loop(n):
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+def trace_memory(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {elapsed:8.3f}s peak {peak/1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    build = measure("run with build()", run_build, 100000)
+    reuse = measure("run with reused build", run_instance, 100000)
+    print(f"speedup {build/reuse:.2f}x")
+
+    measure("register 10k new policies", run_register, 10000)
+    uncached = measure("re-register, no memo", run_register_uncached, 10000)
+    cached = measure("re-register, memoized", run_register, 10000)
+    print(f"speedup {uncached/cached:.2f}x")
+
+    program = Program.address(loop).program
+    trace_memory("trace full text", lambda: program.trace(50000))
+    trace_memory("trace hash only", lambda: program.run_traced(Tracer("hash"), 50000))
@@ -2,4 +2,4 @@ from mockchain.bitcoin import Bitcoin
 from mockchain.blockchain import Wallet, TransactionStatus
 from mockchain.cardano import Cardano
 from mockchain.scenario import Scenario, Agent
-from mockchain.crypto import Cryptic, Address
+from mockchain.crypto import Cryptic, Address, Registry
@@ -1,7 +1,10 @@
+import heapq
 from enum import Enum
-from mockchain.crypto import hash, commit, Key, Public, Address, Cryptic
+from mockchain.crypto import hash, commit, Key, Public, Address, Cryptic, Registry, scoped
 from typing import List, Optional, Union, Dict
 from mockchain.blockchain import Wallet, Transaction, TransactionStatus, Blockchain
+from mockchain.coinselection import Strategy, select
+from mockchain.mempool import Mempool
 
 
 class Operation:
@@ -84,16 +87,19 @@ class Script:
     def __repr__(self):
         return "{"+" ".join([op.__repr__() for op in self.script])+"}"
     
+    def owner(self) -> Optional[str]:
+        if len(self.script) == 1 and self.script[0].opcode == "check_sig":
+            return self.script[0].args[0]
+        
+        if len(self.script) == 2 and self.script[0].opcode == "check_sig" and self.script[1].opcode == "timelock":
+            return self.script[0].args[0]
+        
+        return None
+
     def is_p2pubkey(self, addr : any):
         addr = Address.get_str(addr)
 
-        if len(self.script) == 1 and self.script[0].opcode == "check_sig" and self.script[0].args[0] == addr:
-            return True
-        
-        if len(self.script) == 2 and self.script[0].opcode == "check_sig" and self.script[1].opcode == "timelock" and self.script[0].args[0] == addr:
-            return True
-        
-        return False
+        return self.owner() == addr
     
     def is_p2timelock(self):
         return any(op.opcode == "timelock" for op in self.script)
@@ -197,6 +203,14 @@ class Output:
             if script.is_p2pubkey(addr):
                 return True
         return False
+
+    def owners(self) -> List[str]:
+        owners = []
+        for script in self.scripts:
+            owner = script.owner()
+            if owner is not None and owner not in owners:
+                owners.append(owner)
+        return owners
     
     def satisfy(self, leaf : int, witness : List[str], tx) -> bool:
         stack = witness.copy()
@@ -250,6 +264,30 @@ class Input:
         return ptr + " ["+", ".join([str(w) for w in self.witness])+"]"
     
 
+class ScriptTransaction:
+    def __init__(self, hash : str, sequence : int):
+        self.hash = hash
+        self.sequence = sequence
+
+
+def satisfy_input(job):
+    output, sequence, leaf, witness, txhash, txsequence, addresses = job
+
+    output.sequence = sequence
+
+    # a throwaway scope so the worker doesn't accumulate addresses and names
+    with Registry() as scope:
+        for address in addresses:
+            Address.register(address.value, address)
+
+        try:
+            result = output.satisfy(leaf, witness, ScriptTransaction(txhash, txsequence))
+        except Exception:
+            result = None
+
+    return result, dict(scope.values)
+
+
 class BitcoinTransaction(Transaction):
     def __init__(self, blockchain : "Bitcoin", inputs : List[Input|str], outputs : List[Output]):
         if not isinstance(inputs, list):
@@ -268,6 +306,7 @@ class BitcoinTransaction(Transaction):
         self.inputs = inputs
         self.outputs = outputs
         self.status = TransactionStatus.CREATED
+        self.prior_status = TransactionStatus.CREATED
 
         self.calculate_hash()
         
@@ -277,6 +316,16 @@ class BitcoinTransaction(Transaction):
         return BitcoinTransaction(self.blockchain, inputs, outputs)
         
 
+    def size(self) -> int:
+        # rough byte estimate: outpoint + witness per input, amount + scripts per output
+        size = 10
+        for input in self.inputs:
+            # signatures are (r, s) pairs whose printed length varies, count them at a fixed 64 bytes
+            size += 41 + sum([64 if isinstance(witness, tuple) else len(str(witness)) for witness in input.witness])
+        for output in self.outputs:
+            size += 9 + sum([25 * len(script.script) for script in output.scripts])
+        return size
+
     def calculate_hash(self):
         txdata = ",".join([input.ptr for input in self.inputs]) + " -> " + ",".join([str(output.amount)+":"+output.hash for output in self.outputs])
         self.hash = hash(str(txdata))
@@ -295,12 +344,12 @@ class BitcoinTransaction(Transaction):
         satisfied = True
 
         for input in self.inputs:
-            if input.ptr not in self.blockchain.utxo_set:
+            output = self.blockchain.get_output(input.ptr)
+            if output is None:
                 self.status = TransactionStatus.FAILED
                 self.status_msg = "input not found"
                 return False
             
-            output = self.blockchain.utxo_set[input.ptr]
             if input.leaf < 0 or input.leaf >= len(output.scripts):
                 self.status = TransactionStatus.FAILED
                 self.status_msg = "invalid leaf"
@@ -325,8 +374,9 @@ class BitcoinTransaction(Transaction):
         return self.add_signature(user, signature)
 
 class Bitcoin(Blockchain):
-    def __init__(self, faucet : Wallet = None, supply : int = 1000000, block_reward : int = 50):
-        super().__init__()
+    @scoped
+    def __init__(self, faucet : Wallet = None, supply : int = 1000000, block_reward : int = 50, workers : Optional[int] = None, dust : int = 0, block_size : Optional[int] = None, mempool_count : Optional[int] = None, mempool_size : Optional[int] = None, orphan_blocks : Optional[int] = 10, registry : Optional[Registry] = None):
+        super().__init__(workers, block_size, mempool_count, mempool_size, orphan_blocks, registry)
 
         self.name = "bitcoin"
 
@@ -343,21 +393,68 @@ class Bitcoin(Blockchain):
         self.block_height = 0
         self.block_reward = block_reward
         self.supply = supply
-
-        self.utxo_set = {genesis.ptr : genesis}
-        self.mempool = []
+        self.dust = dust
+
+        # collected by mine_transaction, paid out by the next coinbase
+        self.fees = 0
+        self.fee_ordinals = []
+
+        self.utxo_set = {}
+        self.address_index = {}
+        self.mempool = Mempool()
+        self.timelocked = []
+        self.held = Mempool()
+        self.block_index = { "genesis" : -1 }
         self.blocks = []
         self.subscribers = []
 
         self.transaction_dict = {}
 
+        self.add_utxo(genesis)
+
     def get_transaction(self, hash : str):
         return self.transaction_dict.get(hash,None)
 
+    def add_utxo(self, output : Output):
+        self.utxo_set[output.ptr] = output
+
+        for owner in output.owners():
+            if owner not in self.address_index:
+                self.address_index[owner] = {}
+            self.address_index[owner][output.ptr] = None
+
+    def remove_utxo(self, ptr : str):
+        output = self.utxo_set.pop(ptr)
+
+        for owner in output.owners():
+            ptrs = self.address_index.get(owner)
+            if ptrs is None:
+                continue
+
+            ptrs.pop(ptr, None)
+            if len(ptrs) == 0:
+                del self.address_index[owner]
+
+        return output
+
+    @scoped
     def create_transaction(self, inputs : List[Input|str], outputs : List[Output]):
         return BitcoinTransaction(self, inputs, outputs)
-    
-    def add_transaction(self, transaction : BitcoinTransaction, name : Optional[str] = None):
+
+    def fee(self, transaction : BitcoinTransaction) -> int:
+        amount = 0
+        for input in transaction.inputs:
+            output = self.get_output(input.ptr)
+            if output is not None:
+                amount += output.amount
+
+        return amount - sum([output.amount for output in transaction.outputs])
+
+    @scoped
+    def add_transaction(self, transaction : BitcoinTransaction, name : Optional[str] = None, replace : bool = False) -> bool:
+        if not self.admit(transaction, replace):
+            return False
+
         if name is None:
             name = "tx"+str(len(self.transaction_dict))
 
@@ -367,22 +464,134 @@ class Bitcoin(Blockchain):
             si = str(i)
             Cryptic.add(name+":"+si, transaction.hash +":"+si)
         
-        self.mempool.append(transaction)
         self.transaction_dict[transaction.hash] = transaction
 
+        height = self.earliest_height(transaction)
+        if height > self.block_height:
+            self.hold(transaction, height)
+        else:
+            self.enqueue(transaction)
+
+        return transaction.status != TransactionStatus.EVICTED
+
+    def check_transaction(self, transaction : BitcoinTransaction) -> Optional[str]:
+        msg = super().check_transaction(transaction)
+        if msg is not None:
+            return msg
+
+        for output in transaction.outputs:
+            if output.amount < 0:
+                return "negative output amount"
+
+        return None
+
+    def check_inputs(self, transaction : BitcoinTransaction) -> Optional[str]:
+        msg = super().check_inputs(transaction)
+        if msg is not None:
+            return msg
+
+        for input in transaction.inputs:
+            output = self.get_output(input.ptr)
+            if output is not None and (input.leaf < 0 or input.leaf >= len(output.scripts)):
+                return "invalid leaf for input: "+input.ptr
+
+        return None
+
+    def check_witnesses(self, transaction : BitcoinTransaction) -> Optional[str]:
+        # timelocks are left to hold(), so run the scripts as if they had matured
+        for input in transaction.inputs:
+            output = self.get_output(input.ptr)
+            if output is None or len(input.witness) == 0:
+                continue
+
+            try:
+                satisfied = output.satisfy(input.leaf, input.witness, ScriptTransaction(transaction.hash, float("inf")))
+            except Exception:
+                # an incomplete witness, more signatures may follow
+                continue
+
+            if not satisfied:
+                return "invalid witness for input: "+input.ptr
+
+        return None
+
+    def spender(self, ptr : str) -> Optional[BitcoinTransaction]:
+        spender = self.mempool.spender(ptr)
+        if spender is None:
+            spender = self.held.spender(ptr)
+
+        return spender
+
+    def is_pending(self, hash : str) -> bool:
+        return super().is_pending(hash) or self.held.get(hash) is not None
+
+    def pools(self) -> List[Mempool]:
+        # held transactions are waiting for a block like the rest
+        return [self.mempool, self.held]
+
+    def evict(self, transaction : BitcoinTransaction, status_msg : str, status : TransactionStatus = TransactionStatus.FAILED) -> List[BitcoinTransaction]:
+        self.unhold(transaction)
+        return super().evict(transaction, status_msg, status)
+
+    def earliest_height(self, transaction : BitcoinTransaction) -> int:
+        # unconfirmed parents are assumed to confirm in the next block
+        height = self.block_height
+        for input in transaction.inputs:
+            output = self.get_output(input.ptr)
+            if output is None or input.leaf < 0 or input.leaf >= len(output.scripts):
+                continue
+
+            sequence = output.sequence if input.ptr in self.utxo_set else self.block_height
+            for op in output.scripts[input.leaf].script:
+                if op.opcode == "timelock":
+                    height = max(height, sequence + int(op.args[0]))
+
+        return height
+
+    def hold(self, transaction : BitcoinTransaction, height : int):
+        transaction.status_msg = "timelocked until height "+str(height)
+        if self.held.get(transaction.hash) is not None:
+            return
+
+        self.enqueue(transaction, self.held)
+        seq = self.held.seq.get(transaction.hash)
+        if seq is None:
+            # didn't make the cut
+            return
+
+        # ties release in the order they were held, never by memory address
+        heapq.heappush(self.timelocked, (height, seq, transaction))
 
-    def mine_transaction(self, transaction : BitcoinTransaction, check_inputs=True): 
+    def unhold(self, transaction : BitcoinTransaction):
+        if self.held.get(transaction.hash) is transaction:
+            self.held.remove(transaction)
+
+    def release_timelocked(self):
+        while len(self.timelocked) > 0 and self.timelocked[0][0] <= self.block_height:
+            height, seq, transaction = heapq.heappop(self.timelocked)
+            if self.held.seq.get(transaction.hash) != seq:
+                # evicted or held again since
+                continue
+
+            self.unhold(transaction)
+            if transaction.status not in (TransactionStatus.CONFIRMED, TransactionStatus.FAILED, TransactionStatus.EVICTED):
+                transaction.status_msg = ""
+                self.enqueue(transaction)
+
+
+    @scoped
+    def mine_transaction(self, transaction : BitcoinTransaction, check_inputs=True, verified : Optional[Dict] = None, ordinals : Optional[List] = None): 
         if transaction.status == TransactionStatus.CONFIRMED:
             transaction.status_msg = "already mined"
             return False
            
         allocated = sum([output.amount for output in transaction.outputs])
         amount = 0
-        ordinals = []
+        ordinals = list(ordinals) if ordinals is not None else []
 
         transaction.sequence = self.block_height
         if check_inputs:
-            for input in transaction.inputs:
+            for i, input in enumerate(transaction.inputs):
                 ptr = input.ptr
 
                 if ptr not in self.utxo_set:
@@ -391,7 +600,12 @@ class Bitcoin(Blockchain):
                     return False
                 
                 output = self.utxo_set[ptr]
-                if output.satisfy(input.leaf, input.witness, transaction) == False:
+                if verified is not None and i in verified and verified[i][0] is output:
+                    satisfied = verified[i][1]
+                else:
+                    satisfied = output.satisfy(input.leaf, input.witness, transaction)
+
+                if satisfied == False:
                     transaction.status_msg = "input not satisfied by witness: "+ ptr
                     transaction.status = TransactionStatus.FAILED
                     return False
@@ -406,15 +620,11 @@ class Bitcoin(Blockchain):
                 return False
         
         for input in transaction.inputs:
-            del self.utxo_set[input.ptr]
+            self.remove_utxo(input.ptr)
             
         
         outputs = transaction.outputs
         ordinal_index = 0
-        
-        if amount > allocated:
-            change = Output(amount-allocated,  Script.p2pubkey(self.faucet))
-            outputs.append(change)
 
         for i in range(len(outputs)):
             output = outputs[i]
@@ -441,63 +651,181 @@ class Bitcoin(Blockchain):
                         ordinal_index += 1
                     
 
-            self.utxo_set[output.ptr] = output
+            self.add_utxo(output)
 
+        if amount > allocated:
+            # whatever isn't allocated is the fee, it goes to the miner
+            self.fees += amount-allocated
+            self.fee_ordinals.extend([r for r in ordinals[ordinal_index:] if r[1] > r[0]])
             
+        # drop whatever held it back (timelock, missing input)
+        transaction.status_msg = ""
         transaction.status = TransactionStatus.CONFIRMED
+        self.block_index[transaction.hash] = self.block_height
         return True
 
+    @scoped
     def mine_block(self, cnt=1, miner : Address = None):
         for _ in range(cnt):
             block = []
-            
-            if miner != None:
-                tx = self.create_transaction([], [Output(self.block_reward, Script.p2pubkey(miner))])
-                if self.mine_transaction(tx, check_inputs=False):
-                    tx.txnum = len(block)
-                    block.append(tx)
                 
-            for tx in self.mempool:
-                if self.mine_transaction(tx) == True:
-                    tx.txnum = len(block)
+            self.release_timelocked()
+            transactions = self.block_transactions()
+
+            if self.workers is not None:
+                verified = self.verify_inputs(transactions)
+            else:
+                verified = [None] * len(transactions)
+
+            for tx, checks in zip(transactions, verified):
+                if tx not in self.mempool:
+                    # went with a parent that failed earlier in the block
+                    continue
+
+                ptr = self.waiting_for(tx)
+                if ptr is not None:
+                    tx.status_msg = "waiting for input: "+ptr
+                    continue
+
+                self.mempool.remove(tx)
+
+                height = self.earliest_height(tx)
+                if height > self.block_height:
+                    self.hold(tx, height)
+                    continue
+
+                if self.mine_transaction(tx, verified=checks) == True:
                     block.append(tx)
+                else:
+                    self.fail_descendants(tx)
+
+            # the coinbase goes last so it can collect the fees, without a miner they are burned
+            if miner != None:
+                tx = self.create_transaction([], [Output(self.block_reward + self.fees, Script.p2pubkey(miner))])
+                if self.mine_transaction(tx, check_inputs=False, ordinals=self.fee_ordinals):
+                    block.insert(0, tx)
+
+            self.fees = 0
+            self.fee_ordinals = []
+
+            for i, tx in enumerate(block):
+                tx.txnum = i
             
             self.blocks.append(block)
-            self.mempool = []
 
             self.notify(block)
 
             self.block_height += 1
 
+    def verify_inputs(self, transactions : List[BitcoinTransaction]) -> List[Dict]:
+        pending = {}
+        for tx in transactions:
+            for i in range(len(tx.outputs)):
+                pending[tx.hash+":"+str(i)] = tx.outputs[i]
+
+        jobs = []
+        targets = []
+
+        for index, tx in enumerate(transactions):
+            if tx.status == TransactionStatus.CONFIRMED:
+                continue
+
+            for i, input in enumerate(tx.inputs):
+                if input.ptr in self.utxo_set:
+                    output = self.utxo_set[input.ptr]
+                    sequence = output.sequence
+                elif input.ptr in pending:
+                    output = pending[input.ptr]
+                    sequence = self.block_height
+                else:
+                    continue
+
+                if input.leaf < 0 or input.leaf >= len(output.scripts):
+                    continue
+
+                try:
+                    addresses = [Address.get(op.args[0]) for op in output.scripts[input.leaf].script if op.opcode == "check_sig"]
+                except Exception:
+                    continue
+
+                jobs.append((output, sequence, input.leaf, input.witness, tx.hash, self.block_height, addresses))
+                targets.append((index, i, output))
+
+        verified = [{} for _ in transactions]
+        if len(jobs) == 0:
+            return verified
+
+        results = self.map_workers(satisfy_input, jobs)
+        if results is None:
+            return verified
+
+        for (index, i, output), (result, names) in zip(targets, results):
+            for name, value in names.items():
+                Cryptic.add(name, value)
+
+            if result is not None:
+                verified[index][i] = (output, result)
+
+        return verified
+
             
 
+    @scoped
     def UTXOs_for_address(self, addr : Address):
-        return [ key for key, output in self.utxo_set.items() if output.is_p2pubkey(addr)]
+        addr = Address.get_str(addr)
+        return list(self.address_index.get(addr, {}))
+
+    def check_address_index(self):
+        index = {}
+        for ptr, output in self.utxo_set.items():
+            for owner in output.owners():
+                if owner not in index:
+                    index[owner] = []
+                index[owner].append(ptr)
+
+        current = { owner : list(ptrs) for owner, ptrs in self.address_index.items() }
+        return index == current
                 
     
-    def transfer(self, source : Wallet, destination : Wallet, amount : int):
-        utxos = self.UTXOs_for_address(source)
-        
-        inputs = []
-        
-        total = 0
-        for ptr in utxos:
-            output = self.utxo_set[ptr]
-            inputs.append(Input(ptr))
+    def spendable(self, output : Output, addr : str) -> bool:
+        # what transfer can spend with a plain signature on leaf 0
+        script = output.scripts[0]
+        if script.owner() != addr:
+            return False
 
-            total += output.amount
-            if total >= amount:
-                break
-        
-        if total < amount:
-            raise Exception("insufficient funds")
-        
-        output = Output(amount, Script.p2pubkey(destination))
-        change = Output(total-amount, Script.p2pubkey(source))
-        tx = self.create_transaction(inputs, [output, change])
+        for op in script.script:
+            if op.opcode == "timelock" and output.sequence + int(op.args[0]) > self.block_height:
+                return False
+
+        return True
+
+    def spendable_UTXOs(self, addr : Address):
+        addr = Address.get_str(addr)
+        return [ptr for ptr in self.address_index.get(addr, {}) if self.spendable(self.utxo_set[ptr], addr)]
+
+    @scoped
+    def transfer(self, source : Wallet, destination : Wallet, amount : int, strategy : Strategy = "in-order", fee : int = 0, **kwargs):
+        candidates = [(ptr, self.utxo_set[ptr].amount) for ptr in self.spendable_UTXOs(source)]
+        if "tolerance" not in kwargs:
+            kwargs["tolerance"] = self.dust
+
+        inputs = [Input(ptr) for ptr in select(candidates, amount + fee, strategy, **kwargs)]
+        total = sum([self.utxo_set[input.ptr].amount for input in inputs])
+
+        # change too small for its own output goes with the payment
+        change = total - amount - fee
+        if change <= self.dust:
+            amount += change
+
+        outputs = [Output(amount, Script.p2pubkey(destination))]
+        if change > self.dust:
+            outputs.append(Output(change, Script.p2pubkey(source)))
+
+        tx = self.create_transaction(inputs, outputs)
         tx.sign(source)
         return tx
     
+    @scoped
     def sweep(self, user : Wallet):
         utxos = self.UTXOs_for_address(user)
         total = sum([self.utxo_set[ptr].amount for ptr in utxos])
@@ -507,6 +835,33 @@ class Bitcoin(Blockchain):
         tx.sign(user)
         return tx
 
+    @scoped
+    def consolidate(self, user : Wallet, threshold : int = 50, batch : int = 100) -> List[BitcoinTransaction]:
+        utxos = self.spendable_UTXOs(user)
+        if len(utxos) <= threshold:
+            return []
+
+        utxos.sort(key=lambda ptr: self.utxo_set[ptr].amount)
+
+        transactions = []
+        for i in range(0, len(utxos), batch):
+            ptrs = utxos[i:i+batch]
+            if len(ptrs) < 2:
+                break
+
+            total = sum([self.utxo_set[ptr].amount for ptr in ptrs])
+            tx = self.create_transaction([Input(ptr) for ptr in ptrs], [Output(total, Script.p2pubkey(user))])
+            tx.sign(user)
+            transactions.append(tx)
+
+        return transactions
+
+    async def consolidation(self, user : Wallet, threshold : int = 50, batch : int = 100, max_blocks : Optional[int] = None):
+        async for block in self.block_iterator(max_blocks=max_blocks):
+            for tx in self.consolidate(user, threshold, batch):
+                self.add_transaction(tx)
+
+    @scoped
     def print(self, block_height : Optional[int] = None):
         start = 0
         end = len(self.blocks)
@@ -522,6 +877,7 @@ class Bitcoin(Blockchain):
             for tx in self.blocks[i]:
                 print(f"  {tx}")
 
+    @scoped
     def print_utxos(self):
         for utxo in self.utxo_set:
             print(Cryptic.get(utxo), self.utxo_set[utxo])
@@ -1,7 +1,11 @@
-from typing import Callable, Optional
-from mockchain.crypto import Key, Public, Cryptic, hash, Address
+import os
+import pickle
+from typing import Callable, List, Optional
+from mockchain.crypto import Key, Public, Cryptic, hash, Address, Registry
+from mockchain.mempool import Mempool
 from enum import Enum
 from asyncio import Future
+from concurrent.futures import ProcessPoolExecutor
 
 
 class Wallet:
@@ -33,6 +37,7 @@ class TransactionStatus(Enum):
     PARTIALLY_SIGNED = "partially_signed"
     CONFIRMED = "confirmed"
     FAILED = "failed"
+    EVICTED = "evicted"
 
     def __str__(self):
         return self.value
@@ -41,13 +46,231 @@ class Transaction:
     pass
 
 class Blockchain:
-    def __init__(self):
+    def __init__(self, workers : Optional[int] = None, block_size : Optional[int] = None, mempool_count : Optional[int] = None, mempool_size : Optional[int] = None, orphan_blocks : Optional[int] = 10, registry : Optional[Registry] = None):
+        self.registry = registry if registry is not None else Registry.current
         self.subscribers = []
+        self.workers = workers
+        self.block_size = block_size
+        self.mempool_count = mempool_count
+        self.mempool_size = mempool_size
+        self.orphan_blocks = orphan_blocks
+        self.orphans = {}
+        self.evictions = 0
+        self.evicted_size = 0
+        self.executor = None
 
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        return self.executor
+
+    def map_workers(self, func : Callable, jobs : list) -> Optional[list]:
+        # None when a job can't be shipped to the workers, say a program with a
+        # lambda in its globals, and the caller falls back to the serial path
+        executor = self.get_executor()
+        chunksize = max(1, len(jobs) // (4 * (self.workers or os.cpu_count() or 1)))
+        try:
+            return list(executor.map(func, jobs, chunksize=chunksize))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
     def add_transaction(self, transaction : Transaction):
         pass
 
+    def check_transaction(self, transaction : Transaction) -> Optional[str]:
+        # stateless checks, anything that doesn't need the ledger
+        ptrs = set()
+        for input in transaction.inputs:
+            if input.ptr in ptrs:
+                return "duplicate input: "+input.ptr
+            ptrs.add(input.ptr)
+
+        return None
+
+    def check_inputs(self, transaction : Transaction) -> Optional[str]:
+        # inputs of unknown transactions are let through as orphans, see waiting_for
+        for input in transaction.inputs:
+            if input.ptr in self.utxo_set:
+                continue
+
+            hash = input.ptr.rsplit(":", 1)[0]
+            if hash in self.block_index or self.mempool.get(hash) is not None:
+                if self.mempool.output(input.ptr) is None:
+                    return "input not found: "+input.ptr
+
+        return None
+
+    def check_witnesses(self, transaction : Transaction) -> Optional[str]:
+        # signatures that are there have to verify, missing ones may still come
+        return None
+
+    def spender(self, ptr : str) -> Optional[Transaction]:
+        return self.mempool.spender(ptr)
+
+    def conflicts(self, transaction : Transaction) -> list:
+        conflicts = []
+        for input in transaction.inputs:
+            spender = self.spender(input.ptr)
+            if spender is not None and spender.hash != transaction.hash and spender not in conflicts:
+                conflicts.append(spender)
+
+        return conflicts
+
+    def evict(self, transaction : Transaction, status_msg : str, status : TransactionStatus = TransactionStatus.FAILED) -> list:
+        evicted = [transaction] + self.mempool.descendants(transaction)
+        for tx in evicted:
+            self.mempool.remove(tx)
+            tx.prior_status = tx.status
+            tx.status = status
+            tx.status_msg = status_msg
+
+        return evicted
+
+    def enqueue(self, transaction : Transaction, pool : Optional[Mempool] = None):
+        if pool is None:
+            pool = self.mempool
+
+        size = transaction.size()
+        pool.add(transaction, size, self.fee(transaction) / max(size, 1))
+        self.trim_mempool()
+
+    def pools(self) -> List[Mempool]:
+        # everything that counts against mempool_count and mempool_size
+        return [self.mempool]
+
+    def mempool_full(self) -> bool:
+        if self.mempool_count is not None and sum([len(pool) for pool in self.pools()]) > self.mempool_count:
+            return True
+
+        return self.mempool_size is not None and sum([pool.size for pool in self.pools()]) > self.mempool_size
+
+    def trim_mempool(self):
+        while self.mempool_full():
+            lowest = None
+            for pool in self.pools():
+                entry = pool.peek()
+                if entry is not None and (lowest is None or entry[0] < lowest[0]):
+                    lowest = (entry[0], pool.get(entry[2]))
+
+            # descendants go too, they couldn't be mined without their parent
+            for tx in self.evict(lowest[1], "evicted: mempool full", TransactionStatus.EVICTED):
+                self.evictions += 1
+                self.evicted_size += tx.size()
+
+    def admit(self, transaction : Transaction, replace : bool = False) -> bool:
+        if transaction.status == TransactionStatus.CONFIRMED:
+            transaction.status_msg = "already mined"
+            return False
+
+        if transaction.status == TransactionStatus.FAILED:
+            # keeps the reason it failed
+            return False
+
+        for pool in self.pools():
+            pending = pool.get(transaction.hash)
+            if pending is not None and pending is not transaction:
+                # another copy of it is already waiting, the pools would drop this one silently
+                transaction.status_msg = "already pending: "+transaction.hash
+                transaction.status = TransactionStatus.FAILED
+                return False
+
+        if transaction.status == TransactionStatus.EVICTED:
+            # back to what it was, signatures and all
+            transaction.status = transaction.prior_status
+
+        msg = self.check_transaction(transaction)
+        if msg is None:
+            msg = self.check_inputs(transaction)
+        if msg is None:
+            msg = self.check_witnesses(transaction)
+
+        if msg is None:
+            conflicts = self.conflicts(transaction)
+            if len(conflicts) > 0 and not replace:
+                msg = "conflicts with "+conflicts[0].hash
+
+        if msg is not None:
+            transaction.status_msg = msg
+            transaction.status = TransactionStatus.FAILED
+            return False
+
+        for tx in conflicts:
+            self.evict(tx, "replaced by "+transaction.hash)
+
+        return True
+
+    def get_output(self, ptr : str):
+        output = self.utxo_set.get(ptr)
+        if output is None:
+            output = self.mempool.output(ptr)
+
+        return output
+
+    def fee(self, transaction : Transaction) -> int:
+        pass
+
+    def is_pending(self, hash : str) -> bool:
+        return self.mempool.get(hash) is not None
+
+    def is_orphan(self, transaction : Transaction) -> bool:
+        # spends an output of a transaction we haven't seen, confirmed or pending
+        for input in transaction.inputs:
+            hash = input.ptr.rsplit(":", 1)[0]
+            if input.ptr not in self.utxo_set and hash not in self.block_index and not self.is_pending(hash):
+                return True
+
+        return False
+
+    def track_orphans(self):
+        # remembers the height each orphan was first seen at
+        height = len(self.blocks)
+        orphans = {}
+        for tx in self.mempool:
+            if self.is_orphan(tx):
+                orphans[tx.hash] = self.orphans.get(tx.hash, height)
+
+        self.orphans = orphans
+
+    def orphan_expired(self, transaction : Transaction) -> bool:
+        since = self.orphans.get(transaction.hash)
+        if since is None or self.orphan_blocks is None:
+            return False
+
+        return len(self.blocks) - since >= self.orphan_blocks
+
+    def block_transactions(self) -> list:
+        self.track_orphans()
+        if self.block_size is None:
+            return self.mempool.ordered()
+
+        orphans = [tx for tx in self.mempool if tx.hash in self.orphans and not self.orphan_expired(tx)]
+        return self.mempool.template(self.block_size, lambda tx: tx.size(), self.fee, orphans)
+
+    def waiting_for(self, transaction : Transaction) -> Optional[str]:
+        # an input whose parent hasn't confirmed yet, as opposed to one already spent
+        for input in transaction.inputs:
+            if input.ptr in self.utxo_set:
+                continue
+
+            if input.ptr.rsplit(":", 1)[0] not in self.block_index:
+                if self.orphan_expired(transaction):
+                    # given up on the parent, mine_transaction fails it
+                    return None
+                return input.ptr
+
+        return None
+
+    def fail_descendants(self, transaction : Transaction):
+        # they spend outputs that will never exist now
+        for tx in self.mempool.descendants(transaction):
+            if tx in self.mempool:
+                self.evict(tx, "parent failed: "+transaction.hash)
+
     def transfer(self, source : Wallet, destination : Wallet, amount : int) -> Transaction:
         pass
 
@@ -80,14 +303,14 @@ class Blockchain:
         if tx.status == TransactionStatus.CONFIRMED:
             return True
             
-        if tx.status == TransactionStatus.FAILED:
+        if tx.status in (TransactionStatus.FAILED, TransactionStatus.EVICTED):
             return False
             
         async for block in self.block_iterator(min_height=min_height, max_blocks=max_blocks):
             if tx.status == TransactionStatus.CONFIRMED:
                 return True
             
-            if tx.status == TransactionStatus.FAILED:
+            if tx.status in (TransactionStatus.FAILED, TransactionStatus.EVICTED):
                 return False
             
         return False
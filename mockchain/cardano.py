@@ -1,7 +1,11 @@
 from enum import Enum
-from mockchain.crypto import hash, commit, Key, Public, Cryptic, Address
+import copy
+from mockchain.crypto import hash, commit, Key, Public, Cryptic, Address, Registry, scoped
 from typing import List, Optional, Union, Dict, Tuple, Callable
 from mockchain.blockchain import Wallet, Transaction, TransactionStatus, Blockchain 
+from mockchain.tracing import Meter, BudgetExceeded
+from mockchain.coinselection import Strategy, select_assets
+from mockchain.mempool import Mempool
 
 
 PolicyId = str
@@ -12,8 +16,8 @@ TimeRange = Optional[Tuple]
 
 
 class Value:
-    def __init__(self, value : Dict[PolicyId, Dict[TokenName, int]] = {}):
-        self.value = value
+    def __init__(self, value : Optional[Dict[PolicyId, Dict[TokenName, int]]] = None):
+        self.value = value if value is not None else {}
 
     @staticmethod
     def ADA(amount : int):
@@ -69,44 +73,52 @@ class Value:
         else:
             self.value[key] = value
             
+    def copy(self) -> "Value":
+        return Value({ policy : tokens.copy() for policy, tokens in self.value.items() if len(tokens) > 0 })
+
+    def accumulate(self, other : "Value", sign : int = 1) -> "Value":
+        # in-place sum, only for values nobody else holds (ledger totals)
+        value = self.value
+        for policy, tokens in other.value.items():
+            target = value.get(policy)
+            if target is None:
+                if len(tokens) > 0:
+                    value[policy] = tokens.copy() if sign == 1 else { token : -amount for token, amount in tokens.items() }
+                continue
+
+            for token, amount in tokens.items():
+                target[token] = target.get(token, 0) + sign * amount
+
+        return self
+
+    def is_ada(self) -> bool:
+        tokens = self.value.get("")
+        return len(self.value) == 1 and tokens is not None and len(tokens) == 1 and "ADA" in tokens
+
     def __add__(self, other):
-        value = {}
+        if self.is_ada() and other.is_ada():
+            return Value.ADA(self.value[""]["ADA"] + other.value[""]["ADA"])
 
-        for policy, token, amount in self.items():
-            if policy not in value:
-                value[policy] = {}
-            if token not in value[policy]:
-                value[policy][token] = 0
-            value[policy][token] = amount
-        
-        for policy, token, amount in other.items():
-            if policy not in value:
-                value[policy] = {}
-            if token not in value[policy]:
-                value[policy][token] = 0
-            value[policy][token] += amount
-        
-        return Value(value)
+        return self.copy().accumulate(other)
+
+    def __radd__(self, other):
+        # lets sum() start from 0
+        if type(other) is int and other == 0:
+            return self.copy()
+
+        return NotImplemented
     
     def __sub__(self, other):
-        value = {}
+        if self.is_ada() and other.is_ada():
+            return Value.ADA(self.value[""]["ADA"] - other.value[""]["ADA"])
+
+        return self.copy().accumulate(other, -1)
+
+    def key(self):
+        # values change in place (__setitem__, accumulate), so == and hash() stay by
+        # identity as they always were; compare or hash key() for the contents
+        return tuple(sorted((policy, token, amount) for policy, token, amount in self.items() if amount != 0))
 
-        for policy, token, amount in self.items():
-            if policy not in value:
-                value[policy] = {}
-            if token not in value[policy]:
-                value[policy][token] = 0
-            value[policy][token] = amount
-        
-        for policy, token, amount in other.items():
-            if policy not in value:
-                value[policy] = {}
-            if token not in value[policy]:
-                value[policy][token] = 0
-            value[policy][token] -= amount
-        
-        return Value(value)
-    
     def __str__(self):
         v = ""
         for policy, token, amount in self.items():
@@ -133,6 +145,31 @@ class ScriptPurpose(Enum):
     def __str__(self):
         return self.value
 
+def structure(value):
+    # a canonical form for cache keys. repr() goes through the Cryptic display
+    # names, which aren't unique, so addresses and values go in by their raw fields
+    if value is None or type(value) in (int, float, bool, str, bytes):
+        return value
+    if isinstance(value, Address):
+        return ("address", value.value)
+    if isinstance(value, Value):
+        return ("value", value.key())
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Output):
+        return ("output", value.address.value, value.value.key(), structure(value.datum), getattr(value, "ptr", None), getattr(value, "sequence", None))
+    if isinstance(value, Input):
+        return ("input", value.ptr, structure(value.reference))
+    if isinstance(value, (list, tuple)):
+        return tuple(structure(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(repr(structure(item)) for item in value)))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((repr(structure(key)), structure(item)) for key, item in value.items())))
+
+    return (type(value).__name__, repr(value))
+
+
 class ScriptContext:
     def __init__(self, purpose : ScriptPurpose, transaction : "Transaction", policy : PolicyId | None = None):
         self.purpose = purpose
@@ -140,6 +177,24 @@ class ScriptContext:
         self.policy = policy
         self.txout = None
 
+    def digest(self, names : Optional[set] = None):
+        # names are the attributes the script can reach, None for all of them. A
+        # method could read anything, so naming one keys on everything too
+        tx = self.txinfo
+        if names is not None and any(callable(getattr(type(obj), name, None)) for obj in (self, tx) for name in names):
+            names = None
+
+        if names is None:
+            fields = [self.purpose, self.policy, self.txout, tx.hash, getattr(tx, "sequence", None), tx.inputs, tx.reference_inputs,
+                      tx.outputs, tx.mint, tx.redeemers, tx.signatories, tx.time_range, tx.metadata]
+            return hash(repr(structure(fields)))
+
+        fields = [(name, structure(getattr(self, name))) for name in ("purpose", "policy", "txout") if name in names]
+        if "txinfo" in names:
+            fields += [(name, structure(value)) for name, value in sorted(vars(tx).items()) if name in names]
+
+        return hash(repr(fields))
+
 class Output:
     def __init__(self, address : Address, value : Value | int, datum : Datum = None):
         if type(value) is int:
@@ -157,12 +212,16 @@ class Output:
         self.value = value
         self.datum = datum
     
-    def satisfy(self, transaction : "CardanoTransaction" ) -> bool:
+    def satisfy(self, transaction : "CardanoTransaction", meter : Optional[Meter] = None, verified : Optional[Tuple] = None) -> bool:
         if self.script is not None:
-            context = ScriptContext(ScriptPurpose.Spending, transaction, None)
-            context.txout = self
+            if verified is not None:
+                result = self.script.replay(*verified, meter)
+            else:
+                context = ScriptContext(ScriptPurpose.Spending, transaction, None)
+                context.txout = self
+                result = self.script.validate(transaction.redeemers, context, meter)
 
-            if not self.script.run(transaction.redeemers, context):
+            if not result:
                 return False
             
         if not self.address.is_script:
@@ -194,6 +253,42 @@ class Input:
         return self.ptr
 
 
+def validate_scripts(job):
+    transaction, scripts = job
+
+    addresses = list(transaction.signatories) + [output.address for output in transaction.outputs]
+    addresses += [input.reference.address for input in transaction.inputs if input.reference is not None]
+
+    results = {}
+
+    # a throwaway scope so the worker doesn't accumulate addresses and names
+    with Registry() as scope:
+        for address in addresses:
+            if isinstance(address, Address):
+                Address.register(address.value, address)
+                if not address.is_script:
+                    Address.register(address.public.pubkey, address)
+
+        for key, program, purpose, policy, txout, redeemer, limit, metered in scripts:
+            context = ScriptContext(purpose, transaction, policy)
+            context.txout = txout
+
+            try:
+                if metered:
+                    meter = Meter(limit)
+                    try:
+                        result = program.run_metered(meter, redeemer, context)
+                    except BudgetExceeded:
+                        result = False
+                    results[key] = (result, meter.total)
+                else:
+                    results[key] = (program.run(redeemer, context), None)
+            except Exception:
+                pass
+
+    return results, dict(scope.values)
+
+
 class CardanoTransaction(Transaction):
     def __init__(self, blockchain : "Cardano", inputs : List[Input|str], outputs : List[Output], reference_inputs: List[Input|str] = None, mint: Value = None, metadata : Dict = None):
         inputs = [input if type(input) is Input else Input(input) for input in inputs]
@@ -217,7 +312,9 @@ class CardanoTransaction(Transaction):
         self.signatures = []
         self.signatories = []
         self.redeemers = {}
+        self.units = {}
         self.status = TransactionStatus.CREATED
+        self.prior_status = TransactionStatus.CREATED
 
         # TODO check if this is correct
         self.metadata = metadata if metadata else {}
@@ -236,6 +333,15 @@ class CardanoTransaction(Transaction):
     def __repr__(self):
         return  Cryptic.get(self.hash) + " (" + ",".join([Cryptic.get(input.ptr) for input in self.inputs]) + ") -> (" + ",".join([str(output) for output in self.outputs]) + ") " + self.status.value
     
+    def size(self) -> int:
+        # rough byte estimate in the spirit of the CBOR encoding
+        size = 100 + 40 * len(self.inputs) + 100 * len(self.signatures)
+        for output in self.outputs:
+            size += 60 + 30 * len(list(output.value))
+        for redeemer in self.redeemers.values():
+            size += len(repr(redeemer))
+        return size
+
     def add_signature(self, address : Address, signature : str ):
         self.signatures.append(signature)
         self.signatories.append(address)
@@ -269,8 +375,9 @@ class CardanoTransaction(Transaction):
         return self.metadata.get(key, None)
 
 class Cardano(Blockchain):
-    def __init__(self, faucet : Wallet = None, supply : int = 1000000, block_reward : int = 50):
-        super().__init__()
+    @scoped
+    def __init__(self, faucet : Wallet = None, supply : int = 1000000, block_reward : int = 50, tx_budget : Optional[int] = None, metering : Optional[bool] = None, workers : Optional[int] = None, block_size : Optional[int] = None, mempool_count : Optional[int] = None, mempool_size : Optional[int] = None, orphan_blocks : Optional[int] = 10, registry : Optional[Registry] = None):
+        super().__init__(workers, block_size, mempool_count, mempool_size, orphan_blocks, registry)
         
         self.name = "cardano"
         if faucet is None:
@@ -285,23 +392,87 @@ class Cardano(Blockchain):
         self.height = 0
         self.block_reward = block_reward
         self.supply = supply
-
-        self.utxo_set = {genesis.ptr : genesis}
-        self.mempool = []
+        self.tx_budget = tx_budget
+        self.metering = tx_budget is not None if metering is None else metering
+
+        self.utxo_set = {}
+        self.address_index = {}
+        self.token_index = {}
+        self.mempool = Mempool()
+        self.block_index = { "genesis" : -1 }
         self.blocks = []
         self.policies = {}
         self.transaction_dict = {}
+
+        self.add_utxo(genesis)
     
     def get_transaction(self, hash : str):
         return self.transaction_dict.get(hash,None)
+
+    def add_utxo(self, output : Output):
+        self.utxo_set[output.ptr] = output
+
+        owner = output.address.value
+        if owner not in self.address_index:
+            self.address_index[owner] = {}
+        self.address_index[owner][output.ptr] = None
+
+        for policy, token, amount in output.value.items():
+            if amount == 0:
+                continue
+
+            holders = self.token_index.get((policy, token))
+            if holders is None:
+                holders = self.token_index[(policy, token)] = {}
+            if owner not in holders:
+                holders[owner] = {}
+            holders[owner][output.ptr] = None
+
+    def remove_utxo(self, ptr : str):
+        output = self.utxo_set.pop(ptr)
+
+        owner = output.address.value
+        ptrs = self.address_index[owner]
+        del ptrs[ptr]
+        if len(ptrs) == 0:
+            del self.address_index[owner]
+
+        for policy, token, amount in output.value.items():
+            if amount == 0:
+                continue
+
+            holders = self.token_index[(policy, token)]
+            ptrs = holders[owner]
+            del ptrs[ptr]
+            if len(ptrs) == 0:
+                del holders[owner]
+            if len(holders) == 0:
+                del self.token_index[(policy, token)]
+
+        return output
     
+    @scoped
     def create_transaction(self, inputs : List[Input|str], outputs : List[Output], reference_inputs : List[Input|str] = None, mint : Value = None):
         return CardanoTransaction(self, inputs, outputs, reference_inputs, mint)
     
+    @scoped
     def create_mint_transaction(self, mint : Value, destination : Address, metadata : Dict = None):
         return CardanoTransaction(self, [], [Output(destination, mint)], mint=mint, metadata=metadata)
     
-    def add_transaction(self, transaction : CardanoTransaction, name : Optional[str] = None):
+    def fee(self, transaction : CardanoTransaction) -> int:
+        amount = 0
+        for input in transaction.inputs:
+            output = self.get_output(input.ptr)
+            if output is not None:
+                amount += output.value[("", "ADA")]
+
+        return amount - sum([output.value[("", "ADA")] for output in transaction.outputs])
+
+    @scoped
+    def add_transaction(self, transaction : CardanoTransaction, name : Optional[str] = None, replace : bool = False) -> bool:
+        if not self.admit(transaction, replace):
+            return False
+
         if name is None:
             name = "tx"+str(len(self.transaction_dict))
 
@@ -311,10 +482,24 @@ class Cardano(Blockchain):
             si = str(i)
             Cryptic.add(name+":"+si, transaction.hash +":"+si)
         
-        self.mempool.append(transaction)
         self.transaction_dict[transaction.hash] = transaction
+        self.enqueue(transaction)
+        return transaction.status != TransactionStatus.EVICTED
+
+    def check_witnesses(self, transaction : CardanoTransaction) -> Optional[str]:
+        for signatory, signature in zip(transaction.signatories, transaction.signatures):
+            try:
+                valid = signatory.verify(transaction.hash, signature)
+            except Exception:
+                valid = False
+
+            if not valid:
+                return "invalid signature"
+
+        return None
 
-    def mine_transaction(self, transaction : CardanoTransaction, check_inputs=True): 
+    @scoped
+    def mine_transaction(self, transaction : CardanoTransaction, check_inputs=True, verified : Optional[Tuple] = None): 
         if transaction.status == TransactionStatus.CONFIRMED:
             transaction.status_msg = "already mined"
             return False
@@ -334,11 +519,24 @@ class Cardano(Blockchain):
         allocated = Value()
 
         for output in transaction.outputs:
-            allocated += output.value
+            allocated.accumulate(output.value)
 
-        amount = transaction.mint    
+        amount = transaction.mint.copy()
         transaction.sequence = self.height
 
+        meter = Meter(self.tx_budget) if self.metering else None
+        transaction.units = meter.units if meter is not None else {}
+
+        if check_inputs:
+            for input in transaction.inputs:
+                input.reference = self.utxo_set.get(input.ptr)
+
+        results = {}
+        if verified is not None:
+            references, results = verified
+            if len(references) != len(transaction.inputs) or any(input.reference is not reference for input, reference in zip(transaction.inputs, references)):
+                results = {}
+
         for policy, tokens in transaction.mint.value.items():
             if policy == "" or len(tokens) == 0: 
                 continue
@@ -348,13 +546,23 @@ class Cardano(Blockchain):
             context = ScriptContext(ScriptPurpose.Minting, transaction, policy)
             redeemer = transaction.redeemers[policy] if policy in transaction.redeemers else None
 
-            if not program.run(redeemer, context):
+            try:
+                if policy in results:
+                    result = program.replay(*results[policy], meter)
+                else:
+                    result = program.validate(redeemer, context, meter)
+            except BudgetExceeded as e:
+                transaction.status_msg = "execution budget exceeded: "+str(e)
+                transaction.status = TransactionStatus.FAILED
+                return False
+
+            if not result:
                 transaction.status_msg = "minting policy failed: "+policy
                 transaction.status = TransactionStatus.FAILED
                 return False
 
         if check_inputs:
-            for input in transaction.inputs:
+            for i, input in enumerate(transaction.inputs):
                 ptr = input.ptr
 
                 if ptr not in self.utxo_set:
@@ -363,13 +571,20 @@ class Cardano(Blockchain):
                     return False
                 
                 output = self.utxo_set[ptr]
-                input.reference = output
-                if output.satisfy(transaction) == False:
+
+                try:
+                    satisfied = output.satisfy(transaction, meter, results.get(i))
+                except BudgetExceeded as e:
+                    transaction.status_msg = "execution budget exceeded: "+str(e)
+                    transaction.status = TransactionStatus.FAILED
+                    return False
+
+                if satisfied == False:
                     transaction.status_msg = "input not satisfied: "+ ptr
                     transaction.status = TransactionStatus.FAILED
                     return False
                 
-                amount += output.value    
+                amount.accumulate(output.value)
             
             for policy, token in amount:
                 if amount[(policy, token)] < allocated[(policy, token)]:
@@ -378,18 +593,22 @@ class Cardano(Blockchain):
                     return False
         
         for input in transaction.inputs:
-            del self.utxo_set[input.ptr]
+            self.remove_utxo(input.ptr)
             
         for i in range(len(transaction.outputs)):
             output = transaction.outputs[i]
             output.ptr = transaction.hash+":"+str(i)
             output.sequence = self.height
-            self.utxo_set[output.ptr] = output
+            self.add_utxo(output)
 
         
+        # drop whatever held it back (missing input)
+        transaction.status_msg = ""
         transaction.status = TransactionStatus.CONFIRMED
+        self.block_index[transaction.hash] = self.height
         return True
     
+    @scoped
     def mine_block(self, cnt=1, miner : Address = None):
         for _ in range(cnt):
             block = []
@@ -400,47 +619,199 @@ class Cardano(Blockchain):
                     tx.txnum = len(block)
                     block.append(tx)
                 
-            for tx in self.mempool:
-                if self.mine_transaction(tx) == True:
+            transactions = self.block_transactions()
+
+            if self.workers is not None:
+                verified = self.verify_scripts(transactions)
+            else:
+                verified = [None] * len(transactions)
+
+            for tx, checks in zip(transactions, verified):
+                if tx not in self.mempool:
+                    # went with a parent that failed earlier in the block
+                    continue
+
+                ptr = self.waiting_for(tx)
+                if ptr is not None:
+                    tx.status_msg = "waiting for input: "+ptr
+                    continue
+
+                self.mempool.remove(tx)
+                if self.mine_transaction(tx, verified=checks) == True:
                     tx.txnum = len(block)
                     block.append(tx)
+                else:
+                    self.fail_descendants(tx)
             
             self.blocks.append(block)
-            self.mempool = []
 
             self.notify(block)
             
             self.height += 1
 
 
+    def verify_scripts(self, transactions : List[CardanoTransaction]) -> List[Optional[Tuple]]:
+        pending = {}
+        for tx in transactions:
+            for output in tx.outputs:
+                pending[output.ptr] = output
+
+        jobs = []
+        pending_jobs = []
+        verified = [None] * len(transactions)
+
+        for index, tx in enumerate(transactions):
+            if tx.status == TransactionStatus.CONFIRMED:
+                continue
+
+            references = [self.utxo_set.get(input.ptr, pending.get(input.ptr)) for input in tx.inputs]
+            if any(reference is None for reference in references):
+                continue
+
+            slim = copy.copy(tx)
+            slim.blockchain = None
+            slim.sequence = self.height
+            slim.inputs = [copy.copy(input) for input in tx.inputs]
+            for input, reference in zip(slim.inputs, references):
+                input.reference = reference
+
+            scripts = []
+            for policy, tokens in tx.mint.value.items():
+                if policy == "" or len(tokens) == 0:
+                    continue
+
+                program = Address.get(policy).program
+                redeemer = tx.redeemers[policy] if policy in tx.redeemers else None
+                scripts.append(self.script_job(policy, program, ScriptPurpose.Minting, policy, None, redeemer))
+
+            for i, output in enumerate(references):
+                if output.script is not None:
+                    scripts.append(self.script_job(i, output.script, ScriptPurpose.Spending, None, output, tx.redeemers))
+
+            if len(scripts) == 0:
+                continue
+
+            # pure scripts seen before are answered from the result cache, the
+            # rest go to the workers and their results are cached on the way back
+            cached = {}
+            uncached = []
+            for job in scripts:
+                key, program, purpose, policy, txout, redeemer, limit, metered = job
+                context = ScriptContext(purpose, slim, policy)
+                context.txout = txout
+                cache_key = program.result_key(redeemer, context)
+                hit = program.cache("results").get(cache_key) if cache_key is not None else None
+                if hit is not None and (hit[1] is not None or not metered):
+                    cached[key] = hit
+                else:
+                    uncached.append((job, cache_key))
+
+            if len(uncached) > 0:
+                jobs.append((slim, [job for job, cache_key in uncached]))
+                pending_jobs.append((index, uncached))
+
+            verified[index] = (references, cached)
+
+        if len(jobs) == 0:
+            return verified
+
+        worker_results = self.map_workers(validate_scripts, jobs)
+        if worker_results is None:
+            # whatever the cache answered still holds, mine_transaction runs the rest
+            return verified
+
+        for (index, uncached), (results, names) in zip(pending_jobs, worker_results):
+            for name, value in names.items():
+                Cryptic.add(name, value)
+
+            for job, cache_key in uncached:
+                key, program, purpose, policy, txout, redeemer, limit, metered = job
+                result = results.get(key)
+                if result is None or cache_key is None:
+                    continue
+                # the validate path doesn't cache runs that blew the budget either
+                if limit is not None and result[1] is not None and result[1] > limit:
+                    continue
+                program.cache("results").put(cache_key, result)
+
+            verified[index][1].update(results)
+
+        return verified
+
+    def script_job(self, key, program, purpose : ScriptPurpose, policy : Optional[PolicyId], txout : Optional[Output], redeemer):
+        limits = [limit for limit in (program.budget, self.tx_budget if self.metering else None) if limit is not None]
+        limit = min(limits) if len(limits) > 0 else None
+        metered = self.metering or program.budget is not None
+
+        return (key, program, purpose, policy, txout, redeemer, limit, metered)
+
+    @scoped
     def UTXOs_for_address(self, addr : Address):
         addr = Address.get(addr)
-        return [ key for key, output in self.utxo_set.items() if output.address == addr or output.address == addr.value]
+        return list(self.address_index.get(addr.value, {}))
+
+    @scoped
+    def UTXOs_for_token(self, policy : PolicyId, token : TokenName, addr : Optional[Address] = None):
+        if isinstance(policy, Address):
+            policy = policy.value
+
+        holders = self.token_index.get((policy, token), {})
+
+        if addr is not None:
+            addr = Address.get(addr)
+            return list(holders.get(addr.value, {}))
+
+        return [ ptr for ptrs in holders.values() for ptr in ptrs ]
+
+    def holders(self, policy : PolicyId, token : TokenName):
+        if isinstance(policy, Address):
+            policy = policy.value
+
+        return [ Address.get(owner) for owner in self.token_index.get((policy, token), {}) ]
+
+    def check_indexes(self):
+        address_index = {}
+        token_index = {}
+
+        for ptr, output in self.utxo_set.items():
+            owner = output.address.value
+            address_index.setdefault(owner, []).append(ptr)
+
+            for policy, token, amount in output.value.items():
+                if amount != 0:
+                    token_index.setdefault((policy, token), {}).setdefault(owner, []).append(ptr)
+
+        current_address = { owner : list(ptrs) for owner, ptrs in self.address_index.items() }
+        current_token = { key : { owner : list(ptrs) for owner, ptrs in holders.items() } for key, holders in self.token_index.items() }
+
+        return address_index == current_address and token_index == current_token
                 
     
-    def transfer(self, source : Wallet, destination : Wallet, amount : Value | int):
-        utxos = self.UTXOs_for_address(source)
-        
+    @scoped
+    def transfer(self, source : Wallet, destination : Wallet, amount : Value | int, strategy : Strategy = "largest-first", fee : int = 0, **kwargs):
         if type(amount) is int:
             amount = Value.ADA(amount)
 
-        inputs = []
-        total = Value()
+        spent = amount + Value.ADA(fee) if fee > 0 else amount
 
-        for ptr in utxos:
-            output = self.utxo_set[ptr]
-            
-            for policy,token in output.value:
-                if total[(policy, token)] < amount[(policy, token)]:
-                    inputs.append(Input(ptr))
-                    total += output.value
-                    break
+        def candidates(policy, token):
+            return self.UTXOs_for_token(policy, token, source)
+
+        def amount_of(ptr, policy, token):
+            return self.utxo_set[ptr].value[(policy, token)]
+
+        target = [(policy, token, value) for policy, token, value in spent.items() if value > 0]
+        inputs = [Input(ptr) for ptr in select_assets(target, candidates, amount_of, strategy, **kwargs)]
+
+        total = Value()
+        for input in inputs:
+            total.accumulate(self.utxo_set[input.ptr].value)
         
-        change_value = total - amount
+        change_value = total - spent
         need_change = False
 
         for policy, token in change_value:
-            left = total[(policy, token)] - amount[(policy, token)]
+            left = total[(policy, token)] - spent[(policy, token)]
             if left < 0:
                 raise Exception("insufficient funds")
             
@@ -460,15 +831,19 @@ class Cardano(Blockchain):
 
         return tx
     
+    @scoped
     def sweep(self, user : Wallet):
         utxos = self.UTXOs_for_address(user)
-        total = sum([self.utxo_set[ptr].value for ptr in utxos])
+        total = Value()
+        for ptr in utxos:
+            total.accumulate(self.utxo_set[ptr].value)
 
         output = Output(user, total)
         tx = self.create_transaction([Input(ptr) for ptr in utxos], [output])
         tx.sign(user)
         return tx
     
+    @scoped
     def print(self, block_height : Optional[int] = None):
         start = 0
         end = len(self.blocks)
@@ -485,6 +860,7 @@ class Cardano(Blockchain):
             for tx in self.blocks[i]:
                 print(f"  {tx}")
 
+    @scoped
     def print_utxos(self):
         for utxo in self.utxo_set:
             print(Cryptic.get(utxo), self.utxo_set[utxo])
@@ -0,0 +1,173 @@
+import random
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+Candidate = Tuple[str, int]
+
+
+def in_order(candidates : List[Candidate], target : int, **kwargs) -> Optional[List[str]]:
+    selected = []
+    total = 0
+    for ptr, amount in candidates:
+        if total >= target:
+            break
+        selected.append(ptr)
+        total += amount
+
+    return selected if total >= target else None
+
+
+def largest_first(candidates : List[Candidate], target : int, **kwargs) -> Optional[List[str]]:
+    selected = []
+    total = 0
+    for ptr, amount in sorted(candidates, key=lambda c: c[1], reverse=True):
+        if total >= target:
+            break
+        selected.append(ptr)
+        total += amount
+
+    return selected if total >= target else None
+
+
+def smallest_first(candidates : List[Candidate], target : int, **kwargs) -> Optional[List[str]]:
+    selected = []
+    total = 0
+    for ptr, amount in sorted(candidates, key=lambda c: c[1]):
+        if total >= target:
+            break
+        selected.append(ptr)
+        total += amount
+
+    return selected if total >= target else None
+
+
+def random_improve(candidates : List[Candidate], target : int, rng : Optional[random.Random] = None, **kwargs) -> Optional[List[str]]:
+    # CIP-2: random picks until covered, then top up towards twice the target
+    # so the change looks like a payment and can fund the next one
+    if rng is None:
+        rng = random
+
+    pool = list(candidates)
+    rng.shuffle(pool)
+
+    selected = []
+    total = 0
+    while total < target:
+        if len(pool) == 0:
+            return None
+        ptr, amount = pool.pop()
+        selected.append(ptr)
+        total += amount
+
+    ideal = 2 * target
+    maximum = 3 * target
+    while len(pool) > 0 and total < ideal:
+        ptr, amount = pool.pop()
+        if abs(ideal - (total + amount)) < abs(ideal - total) and total + amount <= maximum:
+            selected.append(ptr)
+            total += amount
+
+    return selected
+
+
+def branch_and_bound(candidates : List[Candidate], target : int, tolerance : int = 0, max_tries : int = 10000, **kwargs) -> Optional[List[str]]:
+    # depth first search for a subset in [target, target + tolerance], so no change is needed
+    pool = sorted(candidates, key=lambda c: c[1], reverse=True)
+    available = sum(amount for ptr, amount in pool)
+
+    best = None
+    best_excess = None
+    selection = []
+    value = 0
+    index = 0
+
+    for _ in range(max_tries):
+        backtrack = False
+        if value + available < target or value > target + tolerance:
+            backtrack = True
+        elif value >= target:
+            if best is None or value - target < best_excess:
+                best = list(selection)
+                best_excess = value - target
+                if best_excess == 0:
+                    break
+            backtrack = True
+
+        if backtrack:
+            if len(selection) == 0:
+                break
+
+            index -= 1
+            while index > selection[-1]:
+                available += pool[index][1]
+                index -= 1
+
+            value -= pool[index][1]
+            selection.pop()
+        else:
+            amount = pool[index][1]
+            available -= amount
+
+            # skip the branch if an equal amount right before was already excluded
+            if len(selection) == 0 or index - 1 == selection[-1] or amount != pool[index-1][1]:
+                selection.append(index)
+                value += amount
+
+        index += 1
+
+    if best is None:
+        return None
+
+    return [pool[i][0] for i in best]
+
+
+strategies = {
+    "in-order": in_order,
+    "largest-first": largest_first,
+    "smallest-first": smallest_first,
+    "random-improve": random_improve,
+    "bnb": branch_and_bound,
+}
+
+Strategy = Union[str, Callable]
+
+
+def get_strategy(strategy : Strategy) -> Callable:
+    if callable(strategy):
+        return strategy
+
+    if strategy not in strategies:
+        raise Exception("Unknown coin selection strategy: "+str(strategy))
+
+    return strategies[strategy]
+
+
+def select(candidates : List[Candidate], target : int, strategy : Strategy = "largest-first", fallback : Strategy = "largest-first", **kwargs) -> List[str]:
+    selected = get_strategy(strategy)(candidates, target, **kwargs)
+    if selected is None and fallback is not None:
+        selected = get_strategy(fallback)(candidates, target, **kwargs)
+
+    if selected is None:
+        raise Exception("insufficient funds")
+
+    return selected
+
+
+def select_assets(target : Iterable[Tuple[str, str, int]], candidates : Callable, amount_of : Callable, strategy : Strategy = "largest-first", **kwargs) -> List[str]:
+    # one asset at a time, rarest first: tokens before ADA so the ADA already
+    # carried by token outputs counts towards the ADA target
+    target = sorted(target, key=lambda asset: asset[0] == "")
+
+    selected = {}
+    for policy, token, amount in target:
+        need = amount - sum(amount_of(ptr, policy, token) for ptr in selected)
+        if need <= 0:
+            continue
+
+        pool = [(ptr, amount_of(ptr, policy, token)) for ptr in candidates(policy, token) if ptr not in selected]
+        pool = [candidate for candidate in pool if candidate[1] > 0]
+
+        asset_strategy = strategy if policy == "" or strategy != "bnb" else "largest-first"
+        for ptr in select(pool, need, asset_strategy, **kwargs):
+            selected[ptr] = None
+
+    return list(selected)
@@ -1,5 +1,8 @@
+import functools
 import hashlib
-from typing import List, Callable
+import secrets
+from collections import OrderedDict
+from typing import List, Callable, Optional
 from types import CodeType, FunctionType, MethodType
 
 Signature = int
@@ -15,19 +18,329 @@ def hash(msg):
 def number_from_hex(hex):
     return int(hex, 16) % N
 
+
+class FixedBase:
+    def __init__(self, base : int, modulus : int, window : int = 11):
+        self.base = base
+        self.modulus = modulus
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.tables = None
+
+    def build(self):
+        tables = []
+        base = self.base
+        size = 1 << self.window
+
+        for _ in range(0, self.modulus.bit_length(), self.window):
+            table = [1] * size
+            for d in range(1, size):
+                table[d] = table[d-1] * base % self.modulus
+            tables.append(table)
+            base = table[-1] * base % self.modulus
+
+        self.tables = tables
+        self.limit = 1 << (self.window * len(tables))
+        return tables
+
+    def pow(self, exponent : int) -> int:
+        tables = self.tables
+        if tables is None:
+            tables = self.build()
+
+        if exponent < 0 or exponent >= self.limit:
+            return pow(self.base, exponent, self.modulus)
+
+        mask = self.mask
+        window = self.window
+        modulus = self.modulus
+
+        result = tables[0][exponent & mask]
+        exponent >>= window
+        i = 1
+        while exponent:
+            result = result * tables[i][exponent & mask] % modulus
+            exponent >>= window
+            i += 1
+
+        return result
+
+
+generator = FixedBase(G, N)
+
+
+def multi_pow(pairs : List[tuple], modulus : int = N, window : int = 3) -> int:
+    size = 1 << window
+    mask = size - 1
+    tables = []
+    bits = 0
+
+    for base, exponent in pairs:
+        table = [1] * size
+        for d in range(1, size):
+            table[d] = table[d-1] * base % modulus
+        tables.append((table, exponent))
+        bits = max(bits, exponent.bit_length())
+
+    result = 1
+    for pos in range(((bits + window - 1) // window - 1) * window, -1, -window):
+        for _ in range(window):
+            result = result * result % modulus
+
+        for table, exponent in tables:
+            digit = (exponent >> pos) & mask
+            if digit:
+                result = result * table[digit] % modulus
+
+    return result
+
+
+# Z_N^* has order 20 * TORSION_ORDER; the order 2, 4 and 5 parts would slip
+# through a random linear combination, so they are checked per signature
+COFACTOR = 20
+TORSION_ORDER = (N-1) // COFACTOR
+G_TORSION = pow(G, TORSION_ORDER, N)
+
+
+def small_order_ok(r : int, s : int, h : int, y_torsion : int) -> bool:
+    # (r * y^h / g^s)^TORSION_ORDER == 1, with the fixed parts reduced mod 20
+    lhs = pow(r, TORSION_ORDER, N) * pow(y_torsion, h % COFACTOR, N) % N
+    return lhs == pow(G_TORSION, s % COFACTOR, N)
+
+
+# with the torsion check on top, a batch costs a bit more than verifying one
+# by one with the builtin pow, so mine_block doesn't use it
+def verify_batch(items : List[tuple]) -> List[bool]:
+    cache = Public.signature_cache
+    results = [False] * len(items)
+    batch = []
+
+    for i, (public, msg, signature) in enumerate(items):
+        if isinstance(public, Address):
+            if public.is_script:
+                raise Exception("Cannot verify with script address")
+            public = public.public
+        else:
+            public = public.get_public()
+
+        if not (isinstance(signature, tuple) and len(signature) == 2 and all(type(x) is int for x in signature)):
+            continue
+
+        key = (public.pubkey, msg, signature)
+        cached = cache.get(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            batch.append((i, public, msg, signature, key))
+
+    if len(batch) == 0:
+        return results
+
+    total = 0
+    pairs = []
+    pubkeys = {}
+    torsion = {}
+    checked = []
+    for item in batch:
+        i, public, msg, (r, s), key = item
+        h = number_from_hex(hash(msg))
+
+        if public.pubkey not in torsion:
+            torsion[public.pubkey] = pow(public.pubkey, TORSION_ORDER, N)
+
+        if not small_order_ok(r % N, s, h, torsion[public.pubkey]):
+            results[i] = False
+            cache.put(key, False)
+            continue
+
+        a = secrets.randbelow(N-1)
+        total = (total + a * s) % (N-1)
+        pairs.append((r % N, a))
+        pubkeys[public.pubkey] = (pubkeys.get(public.pubkey, 0) + a * h) % (N-1)
+        checked.append(item)
+
+    pairs.extend(pubkeys.items())
+
+    if generator.pow(total) == multi_pow(pairs):
+        for i, public, msg, signature, key in checked:
+            results[i] = True
+            cache.put(key, True)
+    else:
+        for i, public, msg, signature, key in checked:
+            results[i] = public.check_signature(msg, signature)
+            cache.put(key, results[i])
+
+    return results
+
+class LRUCache:
+    def __init__(self, size : int = 100000):
+        self.size = size
+        self.enabled = True
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
+        if not self.enabled:
+            return default
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Registry:
+    root = None
+    current = None
+
+    def __init__(self, name_limit : Optional[int] = 100000, parent : Optional["Registry"] = None):
+        if parent is None and Registry.root is not None:
+            parent = Registry.current
+
+        self.name_limit = name_limit
+        self.parent = parent
+        self.previous = []
+        self.names = {}
+        self.values = OrderedDict()
+        self.addresses = {}
+        self.caches = {}
+
+    def __enter__(self):
+        self.previous.append(Registry.current)
+        Registry.current = self
+        return self
+    
+    def __exit__(self, *exc):
+        if len(self.previous) > 0:
+            Registry.current = self.previous.pop()
+
+    def add_name(self, name, value):
+        self.names[value] = name
+        self.values[name] = value
+        self.values.move_to_end(name)
+
+        if self.name_limit is not None:
+            while len(self.values) > self.name_limit:
+                name, value = self.values.popitem(last=False)
+                if self.names.get(value) == name:
+                    del self.names[value]
+
+    def get_name(self, value):
+        registry = self
+        while registry is not None:
+            name = registry.names.get(value)
+            if name is not None:
+                if registry.name_limit is not None and name in registry.values:
+                    registry.values.move_to_end(name)
+                return name
+            registry = registry.parent
+        return None
+
+    def add_address(self, key, address : "Address"):
+        self.addresses[key] = address
+
+    def get_address(self, key) -> Optional["Address"]:
+        registry = self
+        while registry is not None:
+            if key in registry.addresses:
+                return registry.addresses[key]
+            registry = registry.parent
+        return None
+
+    def inherits(self, other : "Registry") -> bool:
+        registry = self.parent
+        while registry is not None:
+            if registry is other:
+                return True
+            registry = registry.parent
+        return False
+
+    def cache(self, name : str, factory : Callable):
+        # caches are per scope, they don't fall back to the parent
+        cache = self.caches.get(name)
+        if cache is None:
+            cache = self.caches[name] = factory()
+        return cache
+
+    def drop(self):
+        self.names.clear()
+        self.values.clear()
+        self.addresses.clear()
+        self.caches.clear()
+
+        while Registry.current is self and len(self.previous) > 0:
+            Registry.current = self.previous.pop()
+
+    def __len__(self):
+        return len(self.values) + len(self.addresses)
+
+
+def scoped(method):
+    # runs a chain or scenario method with its own registry as the current scope
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        registry = getattr(self, "registry", None)
+        if registry is None:
+            # an empty registry is falsy, so no `or` here
+            registry = kwargs.get("registry")
+        if registry is None:
+            registry = Registry.current
+
+        previous = Registry.current
+        Registry.current = registry
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            Registry.current = previous
+
+    return wrapper
+
+
+Registry.root = Registry(name_limit=None)
+Registry.current = Registry.root
+
+
 class Cryptic:
-    names = {}
-    values = {}
+    names = Registry.root.names
+    values = Registry.root.values
 
     @staticmethod
     def add(name, value):
-        Cryptic.names[value] = name
-        Cryptic.values[name] = value
+        Registry.current.add_name(name, value)
 
     @staticmethod
     def get(value):
-        if value in Cryptic.names:
-            return str(Cryptic.names[value])
+        name = Registry.current.get_name(value)
+        if name is not None:
+            return str(name)
         return str(value)
     
 
@@ -63,7 +376,7 @@ class Key:
     def sign(self,msg : str) -> Signature:
         h = number_from_hex(hash(msg))
         k = Secret.number()
-        r = pow(G, k, N)
+        r = generator.pow(k)
         s = (k + self.secret * h) % (N-1)
         sign = (r, s)
         return sign
@@ -83,13 +396,15 @@ class Key:
 
 
 class Public:
+    signature_cache = LRUCache(100000)
+
     def __init__(self, pubkey : int):
         self.pubkey = pubkey
         self.address = Address.get(self)
 
     @staticmethod
     def from_secret(secret):
-        return Public(pow(G, secret, N))
+        return Public(generator.pow(secret))
      
     def get_public(self):
         return self
@@ -101,10 +416,27 @@ class Public:
         raise Exception("Cannot decrypt with public key")
     
     def verify(self, msg : str, signature : Signature) -> bool:
+        cache = Public.signature_cache
+        if not cache.enabled:
+            return self.check_signature(msg, signature)
+
+        key = (self.pubkey, msg, signature)
+        try:
+            result = cache.get(key)
+        except TypeError:
+            return self.check_signature(msg, signature)
+
+        if result is None:
+            result = self.check_signature(msg, signature)
+            cache.put(key, result)
+
+        return result
+
+    def check_signature(self, msg : str, signature : Signature) -> bool:
         h = number_from_hex(hash(msg))
         r,s = signature
 
-        G1 = pow(G, s, N)
+        G1 = generator.pow(s)
         G2 = (r * pow(self.pubkey, h, N)) % N
         return G1 == G2
     
@@ -117,7 +449,15 @@ class Public:
 
 
 class Address:
-    cache = {}
+    cache = Registry.root.addresses
+
+    @staticmethod
+    def find(key) -> Optional["Address"]:
+        return Registry.current.get_address(key)
+
+    @staticmethod
+    def register(key, address : "Address"):
+        Registry.current.add_address(key, address)
 
     @staticmethod 
     def get_str(source) -> str:
@@ -132,8 +472,9 @@ class Address:
             source = hex(source)
 
         if type(source) is str:
-            if source in Address.cache:
-                return Address.cache[source]
+            address = Address.find(source)
+            if address is not None:
+                return address
             
             raise Exception("Address not found")
         
@@ -143,12 +484,13 @@ class Address:
         source = source.get_public()
 
         if isinstance(source,Public):
-            if source.pubkey in Address.cache:
-                return Address.cache[source.pubkey]
+            address = Address.find(source.pubkey)
+            if address is not None:
+                return address
             
             hashcode = hash("public+"+hex(source.pubkey))
             address = Address(source, hashcode, False)
-            Address.cache[source.pubkey] = address
+            Address.register(source.pubkey, address)
             return address
    
         raise Exception("Invalid address source")
@@ -171,7 +513,7 @@ class Address:
         
             self.public = source
         
-        Address.cache[self.value] = self
+        Address.register(self.value, self)
         
 
     def __str__(self):
@@ -182,7 +524,7 @@ class Address:
     
  
 class AggregatePublic(Public):
-    def __init__(self, name : str, publics : List[Public]):
+    def __init__(self, name : str, publics : List[Public], product : int = None):
         self.name = name
 
         pubkeys = [x.get_public().pubkey for x in publics]
@@ -190,10 +532,13 @@ class AggregatePublic(Public):
 
         self.coef = number_from_hex(hash(",".join(map(str, pubkeys))))
 
-        z = 1
-        for p in pubkeys:
-            p = pow(p, self.coef, N)
-            z = (z * p) % N
+        if product is not None:
+            z = pow(product, self.coef, N)
+        else:
+            z = 1
+            for p in pubkeys:
+                p = pow(p, self.coef, N)
+                z = (z * p) % N
 
         self.pubkey = z
         self.address = Address.get(self)
@@ -224,23 +569,79 @@ class Commitment:
 
         return commitment
 
-class TransferOfOnwership:
-    def __init__(self, publics : List[Public]):
+class AggregateGroups:
+    def __init__(self, publics : List[Public], gray_code : bool = False):
         self.publics = publics
-        self.groups = []
-
         self.n = len(publics)
-        self.k = 2 ** self.n
+        self.gray_code = gray_code
+        self.groups = {}
+        self.products = {0: 1}
+        self.inverses = {}
+
+    def __len__(self):
+        return 2 ** self.n
+    
+    def __getitem__(self, i : int) -> Optional[AggregatePublic]:
+        k = len(self)
+        if i < 0:
+            i += k
 
-        for i in range(self.k):
-            group = []
-            for j in range(self.n):
+        if i < 0 or i >= k:
+            raise IndexError("group index out of range")
+
+        if i == 0:
+            return None
+
+        if i in self.groups:
+            return self.groups[i]
+        
+        group = [self.publics[j] for j in range(self.n) if i & (1 << j)]
+        product = self.product(i) if self.gray_code else None
+
+        aggregate = AggregatePublic('gid_'+str(i), group, product)
+        self.groups[i] = aggregate
+        return aggregate
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def pubkey(self, j : int) -> int:
+        return self.publics[j].get_public().pubkey
+    
+    def inverse(self, j : int) -> int:
+        if j not in self.inverses:
+            self.inverses[j] = pow(self.pubkey(j), -1, N)
+        return self.inverses[j]
+
+    def product(self, i : int) -> int:
+        if i in self.products:
+            return self.products[i]
+        
+        for j in range(self.n):
+            neighbour = i ^ (1 << j)
+            if neighbour in self.products:
                 if i & (1 << j):
-                    group.append(publics[j])
+                    product = self.products[neighbour] * self.pubkey(j) % N
+                else:
+                    product = self.products[neighbour] * self.inverse(j) % N
+                break
+        else:
+            lowest = (i & -i).bit_length() - 1
+            product = self.product(i & (i - 1)) * self.pubkey(lowest) % N
+        
+        self.products[i] = product
+        return product
 
-            if len(group) > 0:
-                self.groups.append(AggregatePublic('gid_'+str(i), group))
-            else:
-                self.groups.append(None)
+    def gray(self):
+        for i in range(1, len(self)):
+            yield self[i ^ (i >> 1)]
     
-        
\ No newline at end of file
+
+class TransferOfOnwership:
+    def __init__(self, publics : List[Public], gray_code : bool = False):
+        self.publics = publics
+        self.groups = AggregateGroups(publics, gray_code)
+
+        self.n = len(publics)
+        self.k = 2 ** self.n
@@ -0,0 +1,229 @@
+import heapq
+from typing import Callable, Iterable, List
+
+
+def outpoints(transaction) -> List[str]:
+    return [transaction.hash+":"+str(i) for i in range(len(transaction.outputs))]
+
+
+class Mempool:
+    def __init__(self):
+        self.transactions = {}
+        self.spends = {}
+        self.creates = {}
+        self.sizes = {}
+        self.size = 0
+        self.seq = {}
+        self.cnt = 0
+        self.rates = []
+
+    def add(self, transaction, size : int = 0, rate : float = 0):
+        if transaction.hash in self.transactions:
+            return
+
+        self.transactions[transaction.hash] = transaction
+        self.sizes[transaction.hash] = size
+        self.size += size
+
+        # lowest fee rate first, then oldest
+        self.cnt += 1
+        self.seq[transaction.hash] = self.cnt
+        heapq.heappush(self.rates, (rate, self.cnt, transaction.hash))
+
+        for input in transaction.inputs:
+            self.spends[input.ptr] = transaction.hash
+
+        for ptr in outpoints(transaction):
+            self.creates[ptr] = transaction.hash
+
+    def append(self, transaction):
+        self.add(transaction)
+
+    def remove(self, transaction):
+        if self.transactions.pop(transaction.hash, None) is None:
+            return
+
+        self.size -= self.sizes.pop(transaction.hash)
+        del self.seq[transaction.hash]
+
+        if len(self.rates) > 2 * len(self.transactions) + 64:
+            self.rates = [entry for entry in self.rates if self.seq.get(entry[2]) == entry[1]]
+            heapq.heapify(self.rates)
+
+        for input in transaction.inputs:
+            if self.spends.get(input.ptr) == transaction.hash:
+                del self.spends[input.ptr]
+
+        for ptr in outpoints(transaction):
+            if self.creates.get(ptr) == transaction.hash:
+                del self.creates[ptr]
+
+    def peek(self):
+        # (rate, seq, hash) of the lowest entry still in the pool
+        while len(self.rates) > 0:
+            rate, seq, hash = self.rates[0]
+            if self.seq.get(hash) == seq:
+                return self.rates[0]
+            heapq.heappop(self.rates)
+
+        return None
+
+    def lowest(self):
+        entry = self.peek()
+        if entry is None:
+            return None
+
+        return self.transactions[entry[2]]
+
+    def get(self, hash : str):
+        return self.transactions.get(hash)
+
+    def output(self, ptr : str):
+        hash = self.creates.get(ptr)
+        if hash is None:
+            return None
+
+        return self.transactions[hash].outputs[int(ptr.rsplit(":", 1)[1])]
+
+    def spender(self, ptr : str):
+        hash = self.spends.get(ptr)
+        if hash is None:
+            return None
+
+        return self.transactions[hash]
+
+    def parents(self, transaction) -> List:
+        parents = []
+        for input in transaction.inputs:
+            hash = self.creates.get(input.ptr)
+            if hash is not None and hash != transaction.hash:
+                parent = self.transactions[hash]
+                if parent not in parents:
+                    parents.append(parent)
+
+        return parents
+
+    def descendants(self, transaction) -> List:
+        descendants = []
+        visited = {transaction.hash}
+        stack = [transaction]
+        while len(stack) > 0:
+            for ptr in outpoints(stack.pop()):
+                child = self.spender(ptr)
+                if child is not None and child.hash not in visited:
+                    visited.add(child.hash)
+                    descendants.append(child)
+                    stack.append(child)
+
+        return descendants
+
+    def ordered(self) -> List:
+        # parents before children, otherwise submission order
+        order = []
+        visited = set()
+
+        for root in self.transactions.values():
+            if root.hash in visited:
+                continue
+
+            stack = [(root, False)]
+            while len(stack) > 0:
+                transaction, expanded = stack.pop()
+                if expanded:
+                    order.append(transaction)
+                    continue
+
+                if transaction.hash in visited:
+                    continue
+
+                visited.add(transaction.hash)
+                stack.append((transaction, True))
+
+                for parent in reversed(self.parents(transaction)):
+                    if parent.hash not in visited:
+                        stack.append((parent, False))
+
+        return order
+
+    def ancestors(self, transaction) -> List:
+        ancestors = []
+        visited = {transaction.hash}
+        stack = [transaction]
+        while len(stack) > 0:
+            for parent in self.parents(stack.pop()):
+                if parent.hash not in visited:
+                    visited.add(parent.hash)
+                    ancestors.append(parent)
+                    stack.append(parent)
+
+        return ancestors
+
+    def template(self, limit : int, size : Callable, fee : Callable, exclude : Iterable = ()) -> List:
+        # greedy by ancestor package fee rate, a child pulls in its unconfirmed parents
+        order = {tx.hash: i for i, tx in enumerate(self.ordered())}
+        sizes = {hash: size(self.transactions[hash]) for hash in order}
+        fees = {hash: fee(self.transactions[hash]) for hash in order}
+
+        selected = set()
+        excluded = set(tx.hash for tx in exclude)
+        version = {}
+        heap = []
+        total = 0
+
+        def package(transaction):
+            return [transaction] + [tx for tx in self.ancestors(transaction) if tx.hash not in selected]
+
+        def push(transaction):
+            version[transaction.hash] = version.get(transaction.hash, 0) + 1
+            txs = package(transaction)
+            if any(tx.hash in excluded for tx in txs):
+                return
+
+            weight = sum(sizes[tx.hash] for tx in txs)
+            rate = sum(fees[tx.hash] for tx in txs) / max(weight, 1)
+            heapq.heappush(heap, (-rate, order[transaction.hash], version[transaction.hash], transaction))
+
+        for transaction in self.transactions.values():
+            push(transaction)
+
+        while len(heap) > 0:
+            _, _, v, transaction = heapq.heappop(heap)
+            if transaction.hash in selected or transaction.hash in excluded or v != version[transaction.hash]:
+                continue
+
+            txs = package(transaction)
+            weight = sum(sizes[tx.hash] for tx in txs)
+            if total + weight > limit:
+                # doesn't fit now, it's pushed again with a smaller package once one of its ancestors is selected
+                continue
+
+            total += weight
+            for tx in txs:
+                selected.add(tx.hash)
+
+            touched = set()
+            for tx in txs:
+                for child in self.descendants(tx):
+                    if child.hash not in selected and child.hash not in touched:
+                        touched.add(child.hash)
+                        push(child)
+
+        return sorted([self.transactions[hash] for hash in selected], key=lambda tx: order[tx.hash])
+
+    def clear(self):
+        self.transactions.clear()
+        self.spends.clear()
+        self.creates.clear()
+        self.sizes.clear()
+        self.size = 0
+        self.seq.clear()
+        self.rates.clear()
+
+    def __contains__(self, transaction):
+        return transaction.hash in self.transactions
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def __len__(self):
+        return len(self.transactions)
@@ -0,0 +1,152 @@
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+from mockchain.crypto import hash
+
+
+# leaves and internal nodes are hashed with different tags, so an internal
+# node can't be passed off as a leaf
+LEAF = "\x00"
+NODE = "\x01"
+
+
+def hash_leaf(leaf : str) -> str:
+    return hash(LEAF + leaf)
+
+
+def hash_node(left : str, right : str) -> str:
+    return hash(NODE + left + right)
+
+
+class MerkleTree:
+    def __init__(self, leaves : Sequence[str]):
+        self.leaves = leaves
+        self.levels = [[hash_leaf(leaf) for leaf in leaves]]
+
+        level = self.levels[0]
+        while len(level) > 1:
+            parent = []
+            for i in range(0, len(level) - 1, 2):
+                parent.append(hash_node(level[i], level[i+1]))
+
+            if len(level) % 2 == 1:
+                parent.append(level[-1])
+
+            self.levels.append(parent)
+            level = parent
+
+    def __len__(self):
+        return len(self.leaves)
+
+    @property
+    def depth(self) -> int:
+        return len(self.levels) - 1
+
+    @property
+    def root(self) -> str:
+        if len(self) == 0:
+            return hash("")
+
+        return self.levels[-1][0]
+
+    def node(self, level : int, index : int) -> str:
+        if level == self.depth and index == 0:
+            return self.root
+
+        return self.levels[level][index]
+
+    def proof(self, index : int) -> List[Tuple[str, bool]]:
+        if index < 0 or index >= len(self):
+            raise IndexError("step index out of range")
+
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                proof.append((level[sibling], sibling < index))
+            index //= 2
+
+        return proof
+
+    @staticmethod
+    def verify(root : str, leaf : str, proof : List[Tuple[str, bool]]) -> bool:
+        node = hash_leaf(leaf)
+        for sibling, left in proof:
+            if left:
+                node = hash_node(sibling, node)
+            else:
+                node = hash_node(node, sibling)
+
+        return node == root
+
+
+async def bisect(tree : MerkleTree, query : Callable[..., Awaitable]) -> Optional[int]:
+    length = await query("length")
+    if length != len(tree):
+        return await bisect_prefix(tree, query, min(length, len(tree)))
+
+    level = tree.depth
+    if await query("node", level, 0) == tree.root:
+        return None
+
+    index = 0
+    while level > 0:
+        level -= 1
+        left = 2 * index
+        right = left + 1
+
+        if right >= len(tree.levels[level]):
+            index = left
+        elif await query("node", level, left) != tree.node(level, left):
+            index = left
+        else:
+            index = right
+
+    return index
+
+
+async def bisect_prefix(tree : MerkleTree, query : Callable[..., Awaitable], length : int) -> int:
+    # traces of different lengths only share the subtrees that lie entirely
+    # within the shorter one; if those all match, the traces part at `length`
+    async def first_difference(level, index):
+        start = index << level
+        if start >= length:
+            return None
+
+        if (index + 1) << level <= length:
+            if await query("node", level, index) == tree.node(level, index):
+                return None
+            if level == 0:
+                return index
+
+        if level == 0:
+            return None
+
+        left = await first_difference(level - 1, 2 * index)
+        if left is not None:
+            return left
+
+        return await first_difference(level - 1, 2 * index + 1)
+
+    found = await first_difference(tree.depth, 0)
+    return length if found is None else found
+
+
+def serve_trace(agent, service : str, tree : MerkleTree):
+    async def handler(kind, *args):
+        if kind == "length":
+            return len(tree)
+        if kind == "node":
+            return tree.node(*args)
+        if kind == "leaf":
+            return tree.leaves[args[0]]
+        if kind == "proof":
+            return tree.proof(args[0])
+        raise Exception("Unknown trace request: "+str(kind))
+
+    agent.listen(service, handler)
+
+
+async def challenge(agent, host : str, service : str, tree : MerkleTree) -> Optional[int]:
+    async def query(*message):
+        return await agent.send(host, service, *message)
+
+    return await bisect(tree, query)
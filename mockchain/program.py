@@ -1,62 +1,231 @@
+import ast
+import builtins
+import importlib
 import inspect
 import textwrap
 import sys
-from mockchain.crypto import hash, Address, Cryptic
+from mockchain.crypto import hash, Address, Cryptic, LRUCache, Registry
+from mockchain.tracing import Tracer, Meter, HashFile, BudgetExceeded, env_to_string
+from mockchain.merkle import MerkleTree
 import mockchain.cardano
+from typing import Optional
 
 import code
+import dis
+import marshal
+import tempfile
 import types
 import os
+import weakref
+
+def is_immutable(value):
+    if value is None or type(value) in (int, float, bool, str, bytes, complex):
+        return True
+    
+    if type(value) in (tuple, frozenset):
+        return all(is_immutable(x) for x in value)
+    
+    if type(value) is dict:
+        return all(is_immutable(x) for x in value.values())
+    
+    return False
+
+
+def is_pure_code(code : types.CodeType):
+    if any(name in code.co_names for name in ("globals", "vars", "exec", "eval", "setattr", "__dict__")):
+        return False
+    
+    for instruction in dis.get_instructions(code):
+        if instruction.opname in ("STORE_GLOBAL", "DELETE_GLOBAL"):
+            return False
+        
+    return all(is_pure_code(const) for const in code.co_consts if isinstance(const, types.CodeType))
+
+
+def read_names(code : types.CodeType, globals : dict) -> Optional[set]:
+    # attribute and global names the script uses, None when it could get at the
+    # context some other way: formatting or str() of a whole object, getattr, a
+    # function handed in from outside
+    if any(name in code.co_names for name in ("getattr", "hasattr", "str", "repr", "format", "print", "dir", "vars")):
+        return None
+
+    for instruction in dis.get_instructions(code):
+        if instruction.opname in ("FORMAT_VALUE", "FORMAT_SIMPLE", "FORMAT_WITH_SPEC", "CONVERT_VALUE"):
+            return None
+        if instruction.opname == "BINARY_OP" and instruction.argrepr in ("%", "%="):
+            return None
+
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            inner = read_names(const, {})
+            if inner is None:
+                return None
+            names |= inner
+
+    for value in globals.values():
+        if not (is_immutable(value) or isinstance(value, Address) or any(value is t for t in (mockchain.cardano.Value, mockchain.cardano.ScriptPurpose, mockchain.cardano.ScriptContext))):
+            return None
+
+    return names
+
+
+def swallowing_line(source : str, globals : dict) -> Optional[int]:
+    # the meter stops a script by raising BudgetExceeded from the trace function,
+    # and CPython drops the tracer when that happens. Anything that can catch it
+    # would let the script carry on unmetered, so find the first such construct
+    tree = ast.parse(source)
+    bound = set()
+    imports = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.asname or alias.name.split(".")[0]
+                imports[name] = alias.name if alias.asname else name
+        elif isinstance(node, ast.ImportFrom):
+            bound.update([alias.asname or alias.name for alias in node.names])
+
+    def resolve(expr):
+        # json.JSONDecodeError and the like, as long as the script can't rebind the name
+        if isinstance(expr, ast.Attribute):
+            value = resolve(expr.value)
+            return getattr(value, expr.attr, None) if value is not None else None
+
+        if not isinstance(expr, ast.Name) or expr.id in bound:
+            return None
+
+        if expr.id in imports:
+            try:
+                return importlib.import_module(imports[expr.id])
+            except ImportError:
+                return None
+
+        return globals[expr.id] if expr.id in globals else getattr(builtins, expr.id, None)
+
+    def harmless(expr):
+        value = resolve(expr)
+        return isinstance(value, type) and issubclass(value, Exception)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ExceptHandler):
+            caught = node.type.elts if isinstance(node.type, ast.Tuple) else [node.type]
+            if not all(harmless(expr) for expr in caught):
+                return node.lineno
+        elif isinstance(node, (ast.With, ast.AsyncWith)):
+            # any context manager could suppress it, contextlib.suppress for one
+            return node.lineno
+        elif isinstance(node, (ast.Try, getattr(ast, "TryStar", ast.Try))):
+            # so could leaving a finally block early
+            for statement in node.finalbody:
+                for inner in ast.walk(statement):
+                    if isinstance(inner, (ast.Return, ast.Break, ast.Continue)):
+                        return inner.lineno
+
+    return None
+
+
+def load_code(filename : str):
+    try:
+        with open(filename, "rb") as f:
+            compiled_code = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    
+    if not isinstance(compiled_code, types.CodeType):
+        return None
+    
+    return compiled_code
+
+
+def write_atomic(filename : str, data : bytes):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
 
-def env_to_string(env):
-    res = ""
-    for key, value in env.items():
-        if res == "":
-            res = "{"
-        else:
-            res = res + ", "
-
-        if callable(value):
-            res += f"{key}:<function>" 
-        elif type(value) == int:
-            res += f"{key}:{value}"
-        elif type(value) == str:
-            res += f"{key}:'{value}'"
-        else:
-            res += f"{key}:{value}"
 
-    res += "}"
-    return res
+def load_program(sources, target_function, codehash, globals):
+    # unpickled in workers outside any scope, so keep them in a bounded cache
+    # rather than registering an address for every program ever seen
+    address = Address.find(codehash)
+    if address is not None:
+        return address.program
 
+    program = Program.loaded.get(codehash)
+    if program is None:
+        program = Program(sources, target_function, codehash, globals)
+        Program.loaded.put(codehash, program)
+
+    return program
 
 
 class Program:
     cache = {}
+    cache_dir = ".programs"
+    budget = None
+    pure = False
+    loaded = LRUCache(1000)
+    caches = {
+        "results": lambda: LRUCache(10000),
+        "sources": weakref.WeakKeyDictionary,
+        "codehashes": lambda: LRUCache(100000),
+    }
+
+    @staticmethod
+    def cache(name : str):
+        return Registry.current.cache("program."+name, Program.caches[name])
+
+    @staticmethod
+    def source(function) -> str:
+        code = function.__code__
+        cache = Program.cache("sources")
+        source = cache.get(code)
+        if source is None:
+            source = cache[code] = inspect.getsource(function)
+
+        return source
 
     @staticmethod
     def address(*functions, **globals):
-        sources = "\n".join([inspect.getsource(f) for f in functions])
+        sources = "\n".join([Program.source(f) for f in functions])
         target_function = functions[0].__name__
         
-        codehash = hash(sources + "\n" + str(globals))
+        fingerprint = sources + "\n" + str(globals)
+        cache = Program.cache("codehashes")
+        codehash = cache.get(fingerprint)
+        if codehash is None:
+            codehash = hash(fingerprint)
+            cache.put(fingerprint, codehash)
 
-        if not codehash in Address.cache:
-            Cryptic.add(target_function, codehash)
+        address = Address.find(codehash)
+        if address is None:
             globals = globals.copy()
             globals["Value"]=mockchain.cardano.Value
             globals["ScriptPurpose"]=mockchain.cardano.ScriptPurpose
             globals["ScriptContext"]=mockchain.cardano.ScriptContext
 
             p = Program(sources, target_function, codehash, globals)
+            Cryptic.add(target_function, codehash)
             address = Address(p, codehash, True)
-            Address.cache[codehash] = address
 
-        return Address.cache[codehash]
+        return address
     
     @staticmethod
     def get(codehash : str):
-        if codehash in Address.cache:
-            return Address.cache[codehash].program
+        address = Address.find(codehash)
+        if address is not None:
+            return address.program
         
         return None
     
@@ -72,25 +241,40 @@ class Program:
     def __init__(self, source, target_function, codehash, globals):
         self.sources = textwrap.dedent(source)
         self.target_function = target_function
+
         self.globals = globals
         self.codehash = codehash
         self.cnt = 0
         self.step = {}
         self.compiled_code = None
         self.compiled_code = self.compile()
+        self.reads = read_names(self.compiled_code, globals)
+        self.base = None
+        self.gated = False
+
+    def __reduce__(self):
+        # code objects don't pickle, workers rebuild the program from its source
+        return (load_program, (self.sources, self.target_function, self.codehash, self.globals))
 
     def compile(self):
         if self.compiled_code is not None:
             return self.compiled_code
 
-        if not os.path.exists(".programs"):
-            os.makedirs(".programs")
+        os.makedirs(Program.cache_dir, exist_ok=True)
+
+        filename = Program.cache_dir+"/"+self.codehash+".py"
+        cachename = Program.cache_dir+"/"+self.codehash+"."+sys.implementation.cache_tag+".code"
 
-        filename=".programs/"+self.codehash+".py"
-        with open(filename, "w") as f:
-            f.write(self.sources)
+        compiled_code = load_code(cachename)
+
+        if compiled_code is None:
+            write_atomic(filename, self.sources.encode("utf8"))
+            compiled_code = code.compile_command(self.sources, filename, "exec")
+            if compiled_code is not None:
+                write_atomic(cachename, marshal.dumps(compiled_code))
+        elif not os.path.exists(filename):
+            write_atomic(filename, self.sources.encode("utf8"))
 
-        compiled_code = code.compile_command(self.sources, filename, "exec")
         env = self.globals.copy()
         exec(compiled_code, env)
 
@@ -105,34 +289,118 @@ class Program:
 
         return func, env
     
+    def instance(self):
+        if self.base is None:
+            func, env = self.build()
+            functions = [value for value in env.values() if isinstance(value, types.FunctionType) and value.__globals__ is env]
+            reusable = all(is_immutable(f.__defaults__) and is_immutable(f.__kwdefaults__) and is_pure_code(f.__code__) for f in functions)
+            self.base = (func, env) if reusable else False
+
+        if self.base is False:
+            return self.build()
+
+        return self.base
+    
     def run(self, *args, **kwargs):
-        func, env = self.build()
+        if self.budget is not None:
+            return self.run_metered(Meter(), *args, **kwargs)
+
+        func, env = self.instance()
         self.cnt += 1
         return func(*args, **kwargs)
 
-    def trace(self, *args, **kwargs):
-        func, env = self.build()
-        trace = []
+    def run_metered(self, meter : Meter, *args, **kwargs):
+        if meter.limit(self.budget) is not None:
+            # only matters under a budget, unmetered scripts may catch what they like
+            if not self.gated:
+                self.swallowing = swallowing_line(self.sources, self.globals)
+                self.gated = True
 
+            if self.swallowing is not None:
+                raise BudgetExceeded(f"{self.codehash} could swallow BudgetExceeded (line {self.swallowing}), it can't run under a budget")
 
-        def callback(frame, event, arg):
-            nonlocal trace
-            if event == "line":
-                trace.append(f"#{frame.f_lineno} {env_to_string(frame.f_locals)}")
+        func, env = self.instance()
+        self.cnt += 1
+        return meter.run(self.codehash, self.budget, func, *args, **kwargs)
+
+    def replay(self, result, units : Optional[int], meter : Optional[Meter] = None):
+        self.cnt += 1
+        if units is not None:
+            if meter is None:
+                meter = Meter()
+            meter.charge(self.codehash, self.budget, units)
+
+        return result
+
+    def result_key(self, redeemer, context) -> Optional[str]:
+        if not self.pure or not Program.cache("results").enabled:
+            return None
 
-            return callback
+        # only what the script can read goes into the key, so other transactions hit too
+        return self.codehash + ":" + hash(repr(mockchain.cardano.structure(redeemer))) + ":" + context.digest(self.reads)
 
-        sys.settrace(callback)
+    def validate(self, redeemer, context, meter : Optional[Meter] = None):
+        key = self.result_key(redeemer, context)
+        if key is None:
+            if meter is None:
+                return self.run(redeemer, context)
+            return self.run_metered(meter, redeemer, context)
+
+        cache = Program.cache("results")
+        cached = cache.get(key)
+
+        if cached is not None:
+            result, units = cached
+            if meter is None:
+                return result
+            if units is not None:
+                meter.charge(self.codehash, self.budget, units)
+                return result
+
+        if meter is None:
+            result = self.run(redeemer, context)
+            units = None
+        else:
+            before = meter.units.get(self.codehash, 0)
+            result = self.run_metered(meter, redeemer, context)
+            units = meter.units[self.codehash] - before
+
+        cache.put(key, (result, units))
+        return result
+
+    def run_traced(self, tracer : Tracer, *args, **kwargs):
+        func, env = self.instance()
+        return tracer.run(func, *args, **kwargs)
+
+    def stream_trace(self, filename : Optional[str], *args, **kwargs) -> HashFile:
+        store = HashFile(filename, "w")
         try:
-            result = func(*args, **kwargs)
-            trace.append(f"Return: {str(result)}")
-        finally:
-            sys.settrace(None)
+            self.run_traced(Tracer("hash", store=store), *args, **kwargs)
+        except BaseException:
+            store.close()
+            raise
+
+        store.flush()
+        return store
 
-        hash_trace = list(map(hash, trace))
+    def trace_tree(self, *args, **kwargs) -> MerkleTree:
+        tracer = Tracer("hash")
+        self.run_traced(tracer, *args, **kwargs)
+        return MerkleTree(tracer.hashes)
+
+    def trace(self, *args, **kwargs):
+        tracer = Tracer("full")
+        self.run_traced(tracer, *args, **kwargs)
+
+        hash_trace = tracer.hashes
 
         for i in range(len(hash_trace)-1):
             self.step[hash_trace[i]] = hash_trace[i+1]
 
-        return hash_trace, trace
+        return hash_trace, tracer.text
+
 
+# the root scope's caches, for code that runs outside any scope
+Program.result_cache = Registry.root.cache("program.results", Program.caches["results"])
+Program.source_cache = Registry.root.cache("program.sources", Program.caches["sources"])
+Program.codehash_cache = Registry.root.cache("program.codehashes", Program.caches["codehashes"])
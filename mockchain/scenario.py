@@ -2,6 +2,7 @@ import re
 from mockchain.blockchain import Blockchain, Wallet
 from mockchain.bitcoin import Bitcoin
 from mockchain.cardano import Cardano
+from mockchain.crypto import Registry
 from typing import List, Optional, Callable
 import asyncio
 
@@ -36,7 +37,14 @@ def get_url(host, service):
     return f"{host}/{service}"
 
 class Scenario:
-    def __init__(self, agents: List[Agent | Callable], blockchains : List[Blockchain] = None):
+    def __init__(self, agents: List[Agent | Callable], blockchains : List[Blockchain] = None, registry : Optional[Registry] = None):
+        # names and addresses created by the scenario live in its own scope
+        self.registry = registry if registry is not None else Registry()
+
+        with self.registry:
+            self.populate(agents, blockchains)
+
+    def populate(self, agents: List[Agent | Callable], blockchains : List[Blockchain] = None):
         if blockchains is None:
             blockchains = [Bitcoin()]
 
@@ -53,6 +61,11 @@ class Scenario:
         for blockchain in self.blockchains:
             self.__setattr__(blockchain.name, blockchain)
 
+            # chains built outside run in the scenario's scope, so they see what the agents
+            # register, their own names are still found through the parent
+            if self.registry.inherits(blockchain.registry):
+                blockchain.registry = self.registry
+
        
         for agent in agents:
             if not isinstance(agent, Agent):
@@ -121,6 +134,10 @@ class Scenario:
 
 
     async def run(self, block_time=0.001, block_limit: Optional[int] = None):
+        with self.registry:
+            return await self.simulate(block_time, block_limit)
+
+    async def simulate(self, block_time=0.001, block_limit: Optional[int] = None):
         self.block_time = block_time
 
         blockchains_task = asyncio.create_task(self.run_blockchains(block_limit))
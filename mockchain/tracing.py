@@ -0,0 +1,280 @@
+import os
+import sys
+import tempfile
+from typing import Callable, Optional
+from mockchain.crypto import hash
+
+
+def env_to_string(env):
+    if len(env) == 0:
+        return "}"
+
+    parts = []
+    for key, value in env.items():
+        if callable(value):
+            parts.append(f"{key}:<function>")
+        elif type(value) == str:
+            parts.append(f"{key}:'{value}'")
+        else:
+            parts.append(f"{key}:{value}")
+
+    return "{" + ", ".join(parts) + "}"
+
+
+class HashFile:
+    size = 20
+    chunk = 4096
+
+    def __init__(self, filename : Optional[str] = None, mode : str = "a"):
+        # mode "w" starts a new trace, "a" reopens an existing one
+        if mode not in ("a", "w"):
+            raise Exception("Invalid mode: "+mode)
+
+        self.temporary = filename is None
+        if filename is None:
+            fd, filename = tempfile.mkstemp(suffix=".trace")
+            os.close(fd)
+
+        self.filename = filename
+        self.file = open(filename, mode+"+b")
+        self.file.seek(0, os.SEEK_END)
+        self.count = self.file.tell() // HashFile.size
+        self.dirty = False
+
+    def append(self, value : str):
+        data = value.encode("ascii")
+        if len(data) != HashFile.size:
+            raise Exception("Invalid hash size")
+
+        self.file.write(data)
+        self.count += 1
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index : int) -> str:
+        if index < 0:
+            index += self.count
+
+        if index < 0 or index >= self.count:
+            raise IndexError("step index out of range")
+
+        self.flush()
+        self.file.seek(index * HashFile.size)
+        return self.file.read(HashFile.size).decode("ascii")
+
+    def __iter__(self):
+        self.flush()
+        position = 0
+        end = self.count * HashFile.size
+
+        while position < end:
+            self.file.seek(position)
+            data = self.file.read(min(HashFile.chunk * HashFile.size, end - position))
+            position += len(data)
+
+            for i in range(0, len(data), HashFile.size):
+                yield data[i:i+HashFile.size].decode("ascii")
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.close()
+
+        if self.temporary and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BudgetExceeded(BaseException):
+    # BaseException so a script can't swallow it with a bare `except Exception`
+    pass
+
+
+class Meter:
+    def __init__(self, budget : Optional[int] = None):
+        self.budget = budget
+        self.total = 0
+        self.units = {}
+
+    def remaining(self) -> Optional[int]:
+        if self.budget is None:
+            return None
+
+        return self.budget - self.total
+
+    def limit(self, limit : Optional[int]) -> Optional[int]:
+        remaining = self.remaining()
+        if limit is None or (remaining is not None and remaining < limit):
+            return remaining
+
+        return limit
+
+    def charge(self, name : str, limit : Optional[int], units : int):
+        limit = self.limit(limit)
+        exceeded = limit is not None and units > limit
+        if exceeded:
+            units = limit + 1
+
+        self.units[name] = self.units.get(name, 0) + units
+        self.total += units
+
+        if exceeded:
+            raise BudgetExceeded(f"{name} exceeded budget of {limit} units")
+
+    def run(self, name : str, limit : Optional[int], func : Callable, *args, **kwargs):
+        limit = self.limit(limit)
+
+        count = 0
+        exceeded = False
+
+        def callback(frame, event, arg):
+            nonlocal count, exceeded
+            if event == "line":
+                count += 1
+                if limit is not None and count > limit:
+                    exceeded = True
+                    raise BudgetExceeded(f"{name} exceeded budget of {limit} units")
+
+            return callback
+
+        previous = sys.gettrace()
+        sys.settrace(callback)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            sys.settrace(previous)
+            self.units[name] = self.units.get(name, 0) + count
+            self.total += count
+
+        if exceeded:
+            raise BudgetExceeded(f"{name} exceeded budget of {limit} units")
+
+        return result
+
+
+class Tracer:
+    modes = ("hash", "full", "sample")
+
+    def __init__(self, mode : str = "hash", sample : int = 1000, backend : Optional[str] = None, store = None):
+        if mode not in Tracer.modes:
+            raise Exception("Invalid trace mode: "+mode)
+
+        if backend is None:
+            backend = "settrace"
+
+        if backend == "monitoring" and not hasattr(sys, "monitoring"):
+            backend = "settrace"
+
+        self.mode = mode
+        self.sample = sample
+        self.backend = backend
+        self.hashes = store if store is not None else []
+        self.text = [] if mode == "full" else None
+        self.samples = {} if mode == "sample" else None
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, text : str):
+        index = len(self.hashes)
+        self.hashes.append(hash(text))
+
+        if self.text is not None:
+            self.text.append(text)
+        elif self.samples is not None and index % self.sample == 0:
+            self.samples[index] = text
+
+    def line(self, frame, lineno : Optional[int] = None):
+        # every mode hashes the formatted locals, so the text is built on each line,
+        # hash and sample modes only save keeping it around
+        if lineno is None:
+            lineno = frame.f_lineno
+        self.add(f"#{lineno} {env_to_string(frame.f_locals)}")
+
+    def run(self, func : Callable, *args, **kwargs):
+        if self.backend == "monitoring":
+            result = self.run_monitoring(func, *args, **kwargs)
+        else:
+            result = self.run_settrace(func, *args, **kwargs)
+
+        self.add(f"Return: {str(result)}")
+        return result
+
+    def run_settrace(self, func : Callable, *args, **kwargs):
+        filename = func.__code__.co_filename
+
+        def callback(frame, event, arg):
+            # only the program's own lines, not a finalizer the collector happens to run
+            if frame.f_code.co_filename != filename:
+                return None
+
+            if event == "line":
+                self.line(frame)
+
+            return callback
+
+        previous = sys.gettrace()
+        sys.settrace(callback)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.settrace(previous)
+
+    def run_monitoring(self, func : Callable, *args, **kwargs):
+        monitoring = sys.monitoring
+        tool = next((tool for tool in range(6) if monitoring.get_tool(tool) is None), None)
+        if tool is None:
+            return self.run_settrace(func, *args, **kwargs)
+
+        filename = func.__code__.co_filename
+        lines = {}
+
+        def line_of(code, offset):
+            table = lines.get(code)
+            if table is None:
+                table = lines[code] = list(code.co_lines())
+            for start, end, line in table:
+                if start <= offset < end:
+                    return line
+            return None
+
+        def callback(code, line_number):
+            if code.co_filename != filename:
+                return
+            self.line(sys._getframe(1), line_number)
+
+        def jump(code, source, destination):
+            # settrace reports a line event on a backward jump even when it stays
+            # on the same line (one-line loops), LINE events don't
+            if code.co_filename != filename or destination > source:
+                return
+            line = line_of(code, destination)
+            if line is not None and line == line_of(code, source):
+                self.line(sys._getframe(1), line)
+
+        events = monitoring.events
+        monitoring.use_tool_id(tool, "mockchain")
+        monitoring.register_callback(tool, events.LINE, callback)
+        monitoring.register_callback(tool, events.JUMP, jump)
+        monitoring.set_events(tool, events.LINE | events.JUMP)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            monitoring.set_events(tool, 0)
+            monitoring.register_callback(tool, events.LINE, None)
+            monitoring.register_callback(tool, events.JUMP, None)
+            monitoring.free_tool_id(tool)
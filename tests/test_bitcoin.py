@@ -1,6 +1,8 @@
 import unittest
+import asyncio
 from mockchain.bitcoin import Bitcoin, Output, Input, Script
 from mockchain.blockchain import Wallet, TransactionStatus
+from mockchain.crypto import commit
 
 
 class TestBitcoin(unittest.TestCase):
@@ -45,8 +47,219 @@ class TestBitcoin(unittest.TestCase):
         self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
         self.assertEqual(tx3.status, TransactionStatus.FAILED)
 
+    def test_address_index(self):
+        blockchain = Bitcoin()
+        faucet = blockchain.faucet
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        tx = blockchain.transfer(faucet, alice, 1000)
+        blockchain.add_transaction(tx)
+        blockchain.mine_block(miner=bob)
+
+        locked = Output(100, [Script.p2timelock(2, bob), Script.p2pubkey(alice)])
+        tx2 = blockchain.create_transaction(blockchain.UTXOs_for_address(alice), [locked, Output(900, Script.p2pubkey(alice))])
+        tx2.sign(alice)
+        blockchain.add_transaction(tx2)
+        blockchain.mine_block()
+
+        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
+        self.assertTrue(blockchain.check_address_index())
+        self.assertEqual(blockchain.UTXOs_for_address(alice), [locked.ptr, tx2.outputs[1].ptr])
+        self.assertEqual(len(blockchain.UTXOs_for_address(bob)), 2)
+
+        blockchain.mine_block()
+        tx3 = blockchain.sweep(bob)
+        blockchain.add_transaction(tx3)
+        blockchain.mine_block()
+
+        self.assertEqual(tx3.status, TransactionStatus.CONFIRMED)
+        self.assertTrue(blockchain.check_address_index())
+        self.assertEqual(blockchain.UTXOs_for_address(bob), [tx3.outputs[0].ptr])
+        self.assertEqual(blockchain.UTXOs_for_address(alice), [tx2.outputs[1].ptr])
+
+
+    def test_timelock_held(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        tx1 = blockchain.transfer(blockchain.faucet, alice, 100)
+        tx2 = blockchain.create_transaction([tx1.outputs[0].hash], [Output(100, Script.p2timelock(3, bob))])
+        tx3 = blockchain.create_transaction([tx2.outputs[0].hash], [Output(100, Script.p2pubkey(alice))])
+        tx3.inputs[0].set_witness([bob.sign(tx3.hash)])
+        blockchain.add_transaction(tx1)
+        tx2.sign(alice)
+        blockchain.add_transaction(tx2)
+        blockchain.add_transaction(tx3)
+
+        self.assertEqual(tx3.status_msg, "timelocked until height 3")
+        self.assertNotIn(tx3, blockchain.mempool)
+
+        blockchain.mine_block()
+        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(tx3.status_msg, "timelocked until height 3")
+
+        blockchain.mine_block(2)
+        self.assertEqual(tx3.status, TransactionStatus.CREATED)
+        self.assertEqual(len(blockchain.timelocked), 1)
+
+        blockchain.mine_block()
+        self.assertEqual(tx3.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(tx3.status_msg, "")
+        self.assertEqual(blockchain.block_index[tx3.hash], 3)
+        self.assertEqual(len(blockchain.timelocked), 0)
+
+
+    def test_timelock_order(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        outputs = [Output(10, Script.p2timelock(2, bob)) for i in range(5)]
+        funding = blockchain.create_transaction(["genesis:0"], outputs + [Output(blockchain.supply - 50, Script.p2pubkey(blockchain.faucet))])
+        funding.sign(blockchain.faucet)
+        blockchain.add_transaction(funding)
+        blockchain.mine_block()
+
+        txs = []
+        for output in reversed(outputs):
+            tx = blockchain.create_transaction([output.hash], [Output(10, Script.p2pubkey(alice))])
+            tx.inputs[0].set_witness([bob.sign(tx.hash)])
+            blockchain.add_transaction(tx)
+            txs.append(tx)
+
+        self.assertEqual([entry[-1] for entry in sorted(blockchain.timelocked)], txs)
+
+        blockchain.mine_block(2)
+        self.assertEqual(blockchain.blocks[-1], txs)
+
+class TestCoinSelection(unittest.TestCase):
+    def fund(self, blockchain, user, amounts):
+        outputs = [Output(amount, Script.p2pubkey(user)) for amount in amounts]
+        change = Output(blockchain.utxo_set["genesis:0"].amount - sum(amounts), Script.p2pubkey(blockchain.faucet))
+        tx = blockchain.create_transaction(["genesis:0"], outputs + [change])
+        tx.sign(blockchain.faucet)
+        blockchain.add_transaction(tx)
+        blockchain.mine_block()
+        return tx
+
+    def test_transfer(self):
+        blockchain = Bitcoin(dust=5)
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        funding = self.fund(blockchain, alice, [10, 25, 40, 70])
+
+        locked = blockchain.create_transaction([funding.outputs[3].ptr], [Output(70, Script.p2timelock(10, alice))])
+        locked.sign(alice)
+        blockchain.add_transaction(locked)
+        blockchain.mine_block()
+
+        tx1 = blockchain.transfer(alice, bob, 35, "bnb")
+        self.assertEqual(sorted(input.ptr for input in tx1.inputs), sorted([funding.outputs[0].ptr, funding.outputs[1].ptr]))
+        self.assertEqual(len(tx1.outputs), 1)
+
+        tx2 = blockchain.transfer(alice, bob, 38, "bnb")
+        self.assertEqual([input.ptr for input in tx2.inputs], [funding.outputs[2].ptr])
+        self.assertEqual([output.amount for output in tx2.outputs], [40])
+
+        # the default still takes UTXOs in index order
+        tx5 = blockchain.transfer(alice, bob, 38)
+        self.assertEqual([input.ptr for input in tx5.inputs], [output.ptr for output in funding.outputs[0:3]])
+        self.assertEqual([output.amount for output in tx5.outputs], [38, 37])
+
+        tx3 = blockchain.transfer(alice, bob, 30, "smallest-first")
+        self.assertEqual([input.ptr for input in tx3.inputs], [funding.outputs[0].ptr, funding.outputs[1].ptr])
+        self.assertEqual([output.amount for output in tx3.outputs], [35])
+
+        tx4 = blockchain.transfer(alice, bob, 20, "largest-first")
+        self.assertEqual([output.amount for output in tx4.outputs], [20, 20])
+
+        with self.assertRaises(Exception):
+            blockchain.transfer(alice, bob, 100)
+
+        blockchain.add_transaction(tx2)
+        blockchain.mine_block()
+        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(blockchain.utxo_set[tx2.hash+":0"].amount, 40)
+        self.assertNotIn(tx2.hash+":1", blockchain.utxo_set)
+
+    def test_consolidate(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        self.fund(blockchain, alice, [i + 1 for i in range(60)])
+
+        self.assertEqual(blockchain.consolidate(alice, threshold=60), [])
+
+        txs = blockchain.consolidate(alice, threshold=50, batch=25)
+        self.assertEqual([len(tx.inputs) for tx in txs], [25, 25, 10])
+        self.assertEqual(blockchain.utxo_set[txs[0].inputs[0].ptr].amount, 1)
+
+        async def run():
+            async def miner():
+                for _ in range(2):
+                    await asyncio.sleep(0)
+                    blockchain.mine_block()
+
+            await asyncio.gather(blockchain.consolidation(alice, threshold=2, batch=25, max_blocks=1), miner())
+
+        asyncio.run(run())
+
+        self.assertEqual(len(blockchain.UTXOs_for_address(alice)), 3)
+        self.assertEqual(sum(blockchain.utxo_set[ptr].amount for ptr in blockchain.UTXOs_for_address(alice)), 1830)
+
+
+class TestParallel(unittest.TestCase):
+    def run_blocks(self, blockchain, alice, bob):
+        txs = []
+        for i in range(5):
+            tx = blockchain.transfer(blockchain.faucet, alice, 10+i)
+            blockchain.add_transaction(tx)
+            txs.append(tx)
+            blockchain.mine_block()
+
+        secret = commit("parallel")
+        locked = Output(5, Script.p2hash([secret], None))
+        tx = blockchain.create_transaction(blockchain.UTXOs_for_address(alice)[0:2], [locked, Output(16, Script.p2pubkey(bob))])
+        tx.sign(alice)
+        txs.append(tx)
+
+        child = blockchain.create_transaction([tx.outputs[1].hash], [Output(16, Script.p2pubkey(alice))])
+        child.inputs[0].set_witness([bob.sign(child.hash)])
+        txs.append(child)
+
+        reveal = blockchain.create_transaction([Input(tx.outputs[0].hash)], [Output(5, Script.p2pubkey(bob))])
+        reveal.inputs[0].set_witness(["parallel"])
+        txs.append(reveal)
+
+        forged = blockchain.create_transaction(blockchain.UTXOs_for_address(alice)[2:3], [Output(12, Script.p2pubkey(bob))])
+        forged.inputs[0].set_witness([bob.sign(forged.hash)])
+        txs.append(forged)
+
+        for tx in txs[5:]:
+            blockchain.add_transaction(tx)
+        blockchain.mine_block(miner=bob)
+
+        return txs
+
+    def test_parallel_matches_serial(self):
+        faucet = Wallet('faucet')
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        serial = Bitcoin(faucet)
+        parallel = Bitcoin(faucet, workers=2)
+
+        serial_txs = self.run_blocks(serial, alice, bob)
+        parallel_txs = self.run_blocks(parallel, alice, bob)
+        parallel.close()
+
+        self.assertEqual([tx.status for tx in serial_txs], [tx.status for tx in parallel_txs])
+        self.assertEqual(serial_txs[-1].status, TransactionStatus.FAILED)
+        self.assertEqual(serial_txs[-2].status, TransactionStatus.CONFIRMED)
+        self.assertEqual([[tx.hash for tx in block] for block in serial.blocks], [[tx.hash for tx in block] for block in parallel.blocks])
+        self.assertEqual({ ptr : output.ordinals for ptr, output in serial.utxo_set.items() }, { ptr : output.ordinals for ptr, output in parallel.utxo_set.items() })
 
-        
         
 class TestOrdinals(unittest.TestCase):
     def test_presupply(self):
@@ -16,6 +16,34 @@ class TestValue(unittest.TestCase):
         value3 = value + value2
         self.assertEqual(value3.value, {"": { "ADA": 300 }})
 
+        value4 = value3 - Value({"test" : { "Random" : 5}, "" : { "ADA" : 300 } })
+        self.assertEqual(value4.value, {"": { "ADA": 0 }, "test" : {"Random" : -5} })
+
+    def test_accumulate(self):
+        value = Value.Token("test", "Random", 1)
+        total = Value()
+        total.accumulate(value).accumulate(value).accumulate(Value.ADA(7))
+
+        self.assertEqual(total.value, {"test" : {"Random" : 2}, "" : {"ADA" : 7}})
+        self.assertEqual(value.value, {"test" : {"Random" : 1}})
+        self.assertEqual(Value().value, {})
+        self.assertEqual(sum([value, value, Value.ADA(7)]).key(), total.key())
+
+    def test_equality(self):
+        value = Value({"test" : { "Random" : 100}, "" : { "ADA" : 200 } })
+        value2 = Value.ADA(200) + Value.Token("test", "Random", 100) + Value.Token("other", "X", 0)
+
+        self.assertEqual(value.key(), value2.key())
+        self.assertEqual(hash(value.key()), hash(value2.key()))
+        self.assertNotEqual(value.key(), Value.ADA(200).key())
+        self.assertEqual(len({value.key(), value2.key(), Value.ADA(200).key()}), 2)
+
+        # the objects themselves compare and hash by identity
+        self.assertEqual(value, value)
+        self.assertNotEqual(value, value2)
+        self.assertEqual(len({value, value2}), 2)
+        self.assertEqual(hash(value), hash(value))
+
 class TestTransactions(unittest.TestCase):
     def test_transfer(self):
         cardano = Cardano()
@@ -35,6 +63,81 @@ class TestTransactions(unittest.TestCase):
         cardano.mine_block()
         self.assertEqual(tx2.status, TransactionStatus.FAILED)
 
+    def test_indexes(self):
+        cardano = Cardano()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        def validation_script(redeemer, context):
+            return True
+
+        policy = Program.address(validation_script)
+
+        tx1 = cardano.create_mint_transaction(Value.Token(policy, "NFT1", 1) + Value.ADA(0), alice)
+        tx1.sign(alice)
+        tx2 = cardano.transfer(cardano.faucet, alice, 100)
+        cardano.add_transaction(tx1)
+        cardano.add_transaction(tx2)
+        cardano.mine_block()
+
+        self.assertEqual(cardano.UTXOs_for_address(alice), [tx1.outputs[0].ptr, tx2.outputs[0].ptr])
+        self.assertEqual(cardano.holders(policy, "NFT1"), [alice.address])
+        self.assertEqual(cardano.UTXOs_for_token(policy, "NFT1", alice), [tx1.outputs[0].ptr])
+
+        tx3 = cardano.sweep(alice)
+        tx4 = cardano.create_transaction([tx3.outputs[0].ptr], [Output(bob, tx3.outputs[0].value)])
+        tx4.sign(alice)
+        cardano.add_transaction(tx3)
+        cardano.add_transaction(tx4)
+        cardano.mine_block()
+
+        self.assertEqual(tx4.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(cardano.UTXOs_for_address(alice), [])
+        self.assertEqual(cardano.holders(policy, "NFT1"), [bob.address])
+        self.assertEqual(cardano.UTXOs_for_token(policy, "NFT1"), [tx4.outputs[0].ptr])
+        self.assertTrue(cardano.check_indexes())
+
+
+    def test_coin_selection(self):
+        cardano = Cardano()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        def validation_script(redeemer, context):
+            return True
+
+        policy = Program.address(validation_script)
+
+        funding = []
+        for amount in [10] * 10 + [100, 35]:
+            funding.append(cardano.transfer(cardano.faucet, alice, amount))
+            cardano.add_transaction(funding[-1])
+            cardano.mine_block()
+
+        mint = cardano.create_mint_transaction(Value.Token(policy, "T", 5) + Value.ADA(0), alice)
+        mint.sign(alice)
+        cardano.add_transaction(mint)
+        cardano.mine_block()
+
+        tx1 = cardano.transfer(alice, bob, 95)
+        self.assertEqual(len(tx1.inputs), 1)
+        self.assertEqual(tx1.outputs[1].value.key(), Value.ADA(5).key())
+
+        tx2 = cardano.transfer(alice, bob, 45, strategy="bnb")
+        self.assertEqual(len(tx2.inputs), 2)
+        self.assertEqual(len(tx2.outputs), 1)
+
+        tx3 = cardano.transfer(alice, bob, Value.Token(policy, "T", 2) + Value.ADA(20))
+        self.assertEqual([input.ptr for input in tx3.inputs], [mint.outputs[0].ptr, funding[10].outputs[0].ptr])
+
+        with self.assertRaises(Exception):
+            cardano.transfer(alice, bob, 1000)
+
+        cardano.add_transaction(tx3)
+        cardano.mine_block()
+        self.assertEqual(tx3.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(cardano.utxo_set[tx3.outputs[1].ptr].value[(policy, "T")], 3)
+
 
 class TestScripts(unittest.TestCase):
     def test_pay2script(self):
@@ -186,4 +289,330 @@ class TestScripts(unittest.TestCase):
         cardano.mine_block()
         self.assertEqual(policy.program.cnt, 2)
         self.assertEqual(tx1.status, TransactionStatus.CONFIRMED)
-        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
\ No newline at end of file
+        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
+
+    def test_budget(self):
+        cardano = Cardano(tx_budget=500)
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        def runaway(redeemer, context):
+            while True:
+                pass
+
+        def validation_script(redeemer, context):
+            return redeemer is not None
+
+        runaway_policy = Program.address(runaway)
+        policy = Program.address(validation_script)
+
+        tx1 = cardano.create_mint_transaction(Value.Token(runaway_policy, "X", 1), alice)
+        tx1.sign(alice)
+        tx2 = cardano.create_mint_transaction(Value.Token(policy, "Y", 1), alice)
+        tx2.set_redeemer(policy, "ok")
+        tx2.sign(alice)
+
+        tx3 = cardano.transfer(cardano.faucet, alice, 100)
+        tx4 = cardano.create_transaction([tx3.outputs[0].ptr], [Output(policy, 100)])
+        tx4.sign(alice)
+        tx5 = cardano.create_transaction([tx4.outputs[0].ptr], [Output(bob, 100)])
+        tx5.set_redeemer(policy, "ok")
+
+        for tx in [tx1, tx2, tx3, tx4, tx5]:
+            cardano.add_transaction(tx)
+        cardano.mine_block()
+
+        self.assertEqual(tx1.status, TransactionStatus.FAILED)
+        self.assertTrue(tx1.status_msg.startswith("execution budget exceeded"))
+        self.assertEqual(tx1.units[runaway_policy.value], 501)
+
+        self.assertEqual(tx2.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(tx2.units, {policy.value: 1})
+        self.assertEqual(tx5.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(tx5.units, {policy.value: 1})
+
+        runaway_policy.program.budget = 100
+        tx6 = cardano.create_mint_transaction(Value.Token(runaway_policy, "X", 2), alice)
+        tx6.sign(alice)
+        cardano.add_transaction(tx6)
+        cardano.mine_block()
+
+        self.assertEqual(tx6.status, TransactionStatus.FAILED)
+        self.assertEqual(tx6.units[runaway_policy.value], 101)
+
+    def test_result_cache(self):
+        cardano = Cardano(tx_budget=1000, orphan_blocks=0)
+        alice = Wallet('alice')
+
+        def pure_policy(redeemer, context):
+            total = 0
+            for i in range(10):
+                total += i
+            return redeemer == "mint"
+
+        policy = Program.address(pure_policy)
+        policy.program.pure = True
+        policy.program.cnt = 0
+        Program.result_cache.clear()
+
+        tx1 = cardano.create_transaction(["missing:0"], [Output(alice, Value.Token(policy, "T", 1))], mint=Value.Token(policy, "T", 1))
+        tx1.set_redeemer(policy, "mint")
+        tx1.sign(alice)
+
+        for i in range(3):
+            # a failed transaction isn't admitted again
+            self.assertEqual(cardano.add_transaction(tx1), i == 0)
+            cardano.mine_block()
+
+            self.assertEqual(tx1.status, TransactionStatus.FAILED)
+            self.assertEqual(tx1.status_msg, "input not found: missing:0")
+            self.assertEqual(tx1.units, {policy.value: 23})
+
+        self.assertEqual(policy.program.cnt, 1)
+        self.assertEqual(Program.result_cache.stats()["hits"], 0)
+
+        tx2 = cardano.create_mint_transaction(Value.Token(policy, "T", 1), alice)
+        tx2.set_redeemer(policy, "burn")
+        tx2.sign(alice)
+        cardano.add_transaction(tx2)
+        cardano.mine_block()
+
+        self.assertEqual(tx2.status, TransactionStatus.FAILED)
+        self.assertEqual(policy.program.cnt, 2)
+
+        policy.program.budget = 10
+        tx3 = cardano.create_transaction(["missing:0"], [Output(alice, Value.Token(policy, "T", 1))], mint=Value.Token(policy, "T", 1))
+        tx3.set_redeemer(policy, "mint")
+        tx3.sign(alice)
+        cardano.add_transaction(tx3)
+        cardano.mine_block()
+
+        # the policy reads nothing from the context, so tx1's result is replayed against the lower budget
+        self.assertTrue(tx3.status_msg.startswith("execution budget exceeded"))
+        self.assertEqual(tx3.units, {policy.value: 11})
+        self.assertEqual(policy.program.cnt, 2)
+
+    def test_result_cache_hits(self):
+        cardano = Cardano(tx_budget=1000)
+        alice = Wallet('alice')
+
+        def pure_policy(redeemer, context):
+            total = 0
+            for i in range(10):
+                total += i
+            return redeemer == "mint"
+
+        policy = Program.address(pure_policy)
+        policy.program.pure = True
+        policy.program.budget = None
+        policy.program.cnt = 0
+        Program.result_cache.clear()
+
+        tx1 = cardano.create_transaction(["missing:0"], [Output(alice, Value.Token(policy, "T", 1))], mint=Value.Token(policy, "T", 1))
+        tx1.set_redeemer(policy, "mint")
+        tx1.sign(alice)
+
+        # same height, same context
+        for i in range(3):
+            cardano.mine_transaction(tx1)
+
+            self.assertEqual(tx1.status, TransactionStatus.FAILED)
+            self.assertEqual(tx1.status_msg, "input not found: missing:0")
+            self.assertEqual(tx1.units, {policy.value: 23})
+
+        self.assertEqual(policy.program.cnt, 1)
+        self.assertEqual(Program.result_cache.stats()["hits"], 2)
+
+        # replayed from the cache against the lower budget
+        policy.program.budget = 10
+        cardano.mine_transaction(tx1)
+
+        self.assertTrue(tx1.status_msg.startswith("execution budget exceeded"))
+        self.assertEqual(tx1.units, {policy.value: 11})
+        self.assertEqual(policy.program.cnt, 1)
+
+    def test_result_cache_mining(self):
+        cardano = Cardano(tx_budget=1000)
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        carol = Wallet('carol')
+
+        def minting(redeemer, context):
+            total = 0
+            for i in range(10):
+                total += i
+            return redeemer == "mint" and context.purpose == ScriptPurpose.Minting
+
+        def signed(redeemer, context):
+            return redeemer in context.txinfo.signatories
+
+        policy = Program.address(minting)
+        policy.program.pure = True
+        policy.program.cnt = 0
+        guarded = Program.address(signed)
+        guarded.program.pure = True
+        guarded.program.cnt = 0
+        Program.result_cache.clear()
+
+        # different transactions in different blocks, the policy only looks at the purpose
+        txs = []
+        for wallet in (alice, bob, carol):
+            tx = cardano.create_mint_transaction(Value.Token(policy, "T", 1), wallet)
+            tx.set_redeemer(policy, "mint")
+            tx.sign(wallet)
+            self.assertTrue(cardano.add_transaction(tx))
+            cardano.mine_block()
+            txs.append(tx)
+
+        self.assertEqual([tx.status for tx in txs], [TransactionStatus.CONFIRMED] * 3)
+        self.assertEqual(len(set(tx.hash for tx in txs)), 3)
+        self.assertEqual([tx.units for tx in txs], [{policy.value: 23}] * 3)
+        self.assertEqual(policy.program.cnt, 1)
+        self.assertEqual(Program.result_cache.stats()["hits"], 2)
+
+        # keyed on the signatories it reads
+        for wallet, signer in ((alice, alice), (bob, bob), (carol, alice)):
+            tx = cardano.create_mint_transaction(Value.Token(guarded, "G", 1), wallet)
+            tx.set_redeemer(guarded, alice.address)
+            tx.sign(signer)
+            cardano.add_transaction(tx)
+            cardano.mine_block()
+            txs.append(tx)
+
+        self.assertEqual([tx.status for tx in txs[3:]], [TransactionStatus.CONFIRMED, TransactionStatus.FAILED, TransactionStatus.CONFIRMED])
+        self.assertEqual(guarded.program.cnt, 2)
+
+    def test_result_cache_keys(self):
+        cardano = Cardano()
+        alice1 = Wallet('alice')
+        alice2 = Wallet('alice')
+
+        def signed_by(redeemer, context):
+            return redeemer in context.txinfo.signatories and context.txinfo.sequence < 5
+
+        policy = Program.address(signed_by)
+        policy.program.pure = True
+        Program.result_cache.clear()
+
+        tx = cardano.create_mint_transaction(Value.Token(policy, "T", 1), alice1)
+        tx.sign(alice1)
+        tx.sequence = 0
+        context = ScriptContext(ScriptPurpose.Minting, tx, policy.value)
+
+        # same display name, different addresses
+        self.assertEqual(repr(alice1.address), repr(alice2.address))
+        self.assertTrue(policy.program.validate(alice1.address, context))
+        self.assertFalse(policy.program.validate(alice2.address, context))
+
+        tx.sequence = 5
+        self.assertFalse(policy.program.validate(alice1.address, context))
+
+
+class TestParallel(unittest.TestCase):
+    def run_blocks(self, cardano, alice, bob):
+        def locked(redeemer, context):
+            references = [input.reference for input in context.txinfo.inputs]
+            return redeemer.get(context.txout.address.value) == "open" and all(reference is not None for reference in references)
+
+        def policy_script(redeemer, context):
+            total = 0
+            for i in range(20):
+                total += i
+            return redeemer == "mint"
+
+        def spin(redeemer, context):
+            while True:
+                pass
+
+        script = Program.address(locked)
+        policy = Program.address(policy_script)
+        runaway = Program.address(spin)
+
+        txs = []
+        funding = cardano.transfer(cardano.faucet, alice, 1000)
+        cardano.add_transaction(funding)
+        cardano.mine_block()
+
+        lock = cardano.create_transaction(cardano.UTXOs_for_address(alice), [Output(script, 100) for i in range(8)] + [Output(alice, 200)])
+        lock.sign(alice)
+        txs.append(lock)
+
+        for i in range(4):
+            tx = cardano.create_transaction([lock.outputs[2*i].ptr, lock.outputs[2*i+1].ptr], [Output(bob, 200)], mint=Value.Token(policy, "LP", 1))
+            tx.outputs[0].value += Value.Token(policy, "LP", 1)
+            tx.set_redeemer(script, "open" if i != 2 else "closed")
+            tx.set_redeemer(policy, "mint")
+            txs.append(tx)
+
+        spinning = cardano.create_mint_transaction(Value.Token(runaway, "X", 1), alice)
+        spinning.sign(alice)
+        txs.append(spinning)
+
+        for tx in txs:
+            cardano.add_transaction(tx)
+        cardano.mine_block()
+
+        return txs
+
+    def test_parallel_matches_serial(self):
+        faucet = Wallet('cardano-faucet')
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        serial = Cardano(faucet, tx_budget=2000)
+        parallel = Cardano(faucet, tx_budget=2000, workers=2)
+
+        serial_txs = self.run_blocks(serial, alice, bob)
+        parallel_txs = self.run_blocks(parallel, alice, bob)
+        parallel.close()
+
+        self.assertEqual([tx.status for tx in serial_txs], [tx.status for tx in parallel_txs])
+        self.assertEqual([tx.units for tx in serial_txs], [tx.units for tx in parallel_txs])
+        self.assertEqual([tx.status for tx in serial_txs[1:]], [TransactionStatus.CONFIRMED, TransactionStatus.CONFIRMED, TransactionStatus.FAILED, TransactionStatus.CONFIRMED, TransactionStatus.FAILED])
+        self.assertTrue(serial_txs[-1].status_msg.startswith("execution budget exceeded"))
+        self.assertEqual([[tx.hash for tx in block] for block in serial.blocks], [[tx.hash for tx in block] for block in parallel.blocks])
+        self.assertEqual(sorted(serial.utxo_set), sorted(parallel.utxo_set))
+
+    def test_parallel_unpicklable(self):
+        cardano = Cardano(tx_budget=2000, workers=2)
+        alice = Wallet('alice')
+
+        def lambda_policy(redeemer, context):
+            return check(redeemer)
+
+        policy = Program.address(lambda_policy, check=lambda redeemer: redeemer == "mint")
+
+        tx = cardano.create_mint_transaction(Value.Token(policy, "T", 1), alice)
+        tx.set_redeemer(policy, "mint")
+        tx.sign(alice)
+
+        self.assertEqual(cardano.verify_scripts([tx])[0][1], {})
+        cardano.add_transaction(tx)
+        cardano.mine_block()
+        cardano.close()
+
+        self.assertEqual(tx.status, TransactionStatus.CONFIRMED)
+
+    def test_parallel_result_cache(self):
+        cardano = Cardano(tx_budget=2000, workers=2)
+        alice = Wallet('alice')
+
+        def pure_policy(redeemer, context):
+            return redeemer == "mint"
+
+        policy = Program.address(pure_policy)
+        policy.program.pure = True
+        Program.result_cache.clear()
+
+        tx = cardano.create_mint_transaction(Value.Token(policy, "T", 1), alice)
+        tx.set_redeemer(policy, "mint")
+        tx.sign(alice)
+
+        verified = cardano.verify_scripts([tx])
+        self.assertEqual(len(Program.result_cache), 1)
+        self.assertEqual(Program.result_cache.stats()["hits"], 0)
+
+        # answered from the cache without going to the workers
+        self.assertEqual(cardano.verify_scripts([tx]), verified)
+        self.assertEqual(Program.result_cache.stats()["hits"], 1)
+        cardano.close()
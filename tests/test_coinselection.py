@@ -0,0 +1,63 @@
+import unittest
+import random
+from mockchain.coinselection import largest_first, smallest_first, random_improve, branch_and_bound, select, select_assets
+
+
+class TestStrategies(unittest.TestCase):
+    def setUp(self):
+        self.candidates = [("a", 5), ("b", 40), ("c", 7), ("d", 13), ("e", 100), ("f", 7)]
+
+    def test_largest_first(self):
+        self.assertEqual(largest_first(self.candidates, 120), ["e", "b"])
+        self.assertEqual(smallest_first(self.candidates, 12), ["a", "c"])
+        self.assertIsNone(largest_first(self.candidates, 1000))
+
+    def test_branch_and_bound(self):
+        self.assertEqual(sorted(branch_and_bound(self.candidates, 25)), ["a", "c", "d"])
+        self.assertEqual(sorted(branch_and_bound(self.candidates, 145)), ["a", "b", "e"])
+        self.assertIsNone(branch_and_bound(self.candidates, 4))
+        self.assertEqual(branch_and_bound(self.candidates, 4, tolerance=1), ["a"])
+
+        amounts = dict(self.candidates)
+        for target in range(1, 173):
+            selected = branch_and_bound(self.candidates, target)
+            if selected is not None:
+                self.assertEqual(sum(amounts[ptr] for ptr in selected), target)
+
+    def test_random_improve(self):
+        amounts = dict(self.candidates)
+        for seed in range(20):
+            selected = random_improve(self.candidates, 30, rng=random.Random(seed))
+            total = sum(amounts[ptr] for ptr in selected)
+            self.assertGreaterEqual(total, 30)
+            self.assertEqual(len(set(selected)), len(selected))
+
+        self.assertIsNone(random_improve(self.candidates, 1000))
+
+    def test_select(self):
+        self.assertEqual(select(self.candidates, 4, "bnb"), ["e"])
+        self.assertEqual(select(self.candidates, 12, "in-order"), [ptr for ptr, amount in self.candidates[:2]])
+        with self.assertRaises(Exception):
+            select(self.candidates, 1000)
+        with self.assertRaises(Exception):
+            select(self.candidates, 10, "unknown")
+
+    def test_select_assets(self):
+        utxos = {
+            "x": {("", "ADA"): 10, ("p", "T"): 3},
+            "y": {("", "ADA"): 50},
+            "z": {("", "ADA"): 20, ("p", "T"): 1},
+        }
+
+        def candidates(policy, token):
+            return [ptr for ptr, value in utxos.items() if (policy, token) in value]
+
+        def amount_of(ptr, policy, token):
+            return utxos[ptr].get((policy, token), 0)
+
+        self.assertEqual(select_assets([("", "ADA", 12), ("p", "T", 2)], candidates, amount_of), ["x", "y"])
+        self.assertEqual(select_assets([("", "ADA", 30), ("p", "T", 4)], candidates, amount_of, "bnb"), ["x", "z"])
+
+
+if __name__ == '__main__':
+    unittest.main()
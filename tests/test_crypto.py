@@ -1,5 +1,5 @@
 import unittest
-from mockchain.crypto import hash, AggregatePublic, Public, Key, TransferOfOnwership, commit, Cryptic, G, N
+from mockchain.crypto import hash, number_from_hex, Registry, Address, AggregatePublic, Public, Key, TransferOfOnwership, commit, Cryptic, G, N, LRUCache, FixedBase, generator, multi_pow, verify_batch
 
 class TestHash(unittest.TestCase):  
     def test_hash(self):
@@ -7,6 +7,20 @@ class TestHash(unittest.TestCase):
         
   
 
+class TestFixedBase(unittest.TestCase):
+    def test_pow(self):
+        exponents = [0, 1, 2, 2047, 2048, N-2, N-1, N, 2**44-1, 2**44, 2**60+5]
+        exponents.extend([number_from_hex(hash(str(i))) for i in range(200)])
+
+        for e in exponents:
+            self.assertEqual(generator.pow(e), pow(G, e, N))
+
+    def test_window(self):
+        table = FixedBase(3, 1000003, window=4)
+        for e in range(0, 5000, 7):
+            self.assertEqual(table.pow(e), pow(3, e, 1000003))
+
+
 class TestKey(unittest.TestCase):
     def test_create(self):
         k = Key('1')
@@ -27,6 +41,83 @@ class TestKey(unittest.TestCase):
         self.assertFalse(k.verify(msg2, sign))
 
 
+    def test_signature_cache(self):
+        k = Key('1')
+        pk = k.get_public()
+        cache = Public.signature_cache
+        msg = 'cached message'
+        sign = k.sign(msg)
+
+        hits = cache.hits
+        misses = cache.misses
+        self.assertTrue(pk.verify(msg, sign))
+        self.assertTrue(pk.address.verify(msg, sign))
+        self.assertFalse(pk.verify('other', sign))
+        self.assertFalse(pk.verify('other', sign))
+        self.assertEqual(cache.hits - hits, 2)
+        self.assertEqual(cache.misses - misses, 2)
+
+        cache.enabled = False
+        try:
+            self.assertTrue(pk.verify(msg, sign))
+            self.assertEqual(cache.hits - hits, 2)
+        finally:
+            cache.enabled = True
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+
+class TestBatch(unittest.TestCase):
+    def test_multi_pow(self):
+        pairs = [(number_from_hex(hash("b"+str(i))), number_from_hex(hash("e"+str(i)))) for i in range(20)]
+        expected = 1
+        for base, exponent in pairs:
+            expected = expected * pow(base, exponent, N) % N
+
+        self.assertEqual(multi_pow(pairs), expected)
+        self.assertEqual(multi_pow([]), 1)
+
+    def test_verify_batch(self):
+        keys = [Key(str(i)) for i in range(8)]
+        items = [(k.get_public(), "batch "+str(i), k.sign("batch "+str(i))) for i, k in enumerate(keys)]
+
+        self.assertEqual(verify_batch(items), [True] * 8)
+        self.assertEqual(verify_batch([]), [])
+
+    def test_verify_batch_failures(self):
+        Public.signature_cache.clear()
+        keys = [Key(str(i)) for i in range(6)]
+        items = [(k.get_public().address, "fail "+str(i), k.sign("fail "+str(i))) for i, k in enumerate(keys)]
+        items[2] = (items[2][0], "tampered", items[2][2])
+        r, s = items[4][2]
+        items[4] = (items[4][0], items[4][1], (N - r, s))
+        items.append((keys[0], "malformed", "signature"))
+
+        self.assertEqual(verify_batch(items), [True, True, False, True, False, True, False])
+        self.assertEqual([public.verify(msg, sign) for public, msg, sign in items[:-1]], [True, True, False, True, False, True])
+
+    def test_verify_batch_negated(self):
+        Public.signature_cache.clear()
+        keys = [Key(str(i)) for i in range(2)]
+        items = []
+        for i, k in enumerate(keys):
+            r, s = k.sign("negated "+str(i))
+            items.append((k.get_public(), "negated "+str(i), (N - r, s)))
+
+        for _ in range(20):
+            self.assertEqual(verify_batch(items), [False, False])
+        self.assertEqual([public.verify(msg, sign) for public, msg, sign in items], [False, False])
+
 
 class TestAggregateKey(unittest.TestCase):
     def test_create(self):
@@ -63,6 +154,31 @@ class TestTransferOfOwnership(unittest.TestCase):
 
         self.assertEqual(apk.pubkey, too.groups[-1].pubkey)
 
+    def test_lazy(self):
+        k = [Key(str(x)) for x in range(24)]
+        pk = [x.get_public() for x in k]
+        too = TransferOfOnwership(pk, gray_code=True)
+
+        self.assertEqual(len(too.groups), 2**24)
+        self.assertEqual(too.groups[-1].pubkey, AggregatePublic('ak', pk).pubkey)
+        self.assertEqual(too.groups[5].pubkey, AggregatePublic('ak', [pk[0], pk[2]]).pubkey)
+        self.assertIs(too.groups[5], too.groups[5])
+        self.assertEqual(len(too.groups.groups), 2)
+
+    def test_gray_code(self):
+        k = [Key(str(x)) for x in range(5)]
+        pk = [x.get_public() for x in k]
+        direct = TransferOfOnwership(pk)
+        gray = TransferOfOnwership(pk, gray_code=True)
+
+        groups = list(gray.groups.gray())
+        self.assertEqual(len(groups), 31)
+        self.assertIsNone(direct.groups[0])
+
+        for group in groups:
+            i = int(group.name[4:])
+            self.assertEqual(group.pubkey, direct.groups[i].pubkey)
+
 
 class TestCommit(unittest.TestCase):
     def test_commit(self):
@@ -86,5 +202,102 @@ class TestEncryptDecrypt(unittest.TestCase):
         self.assertEqual(msg, dec)
 
 
+class TestRegistry(unittest.TestCase):
+    def test_scope(self):
+        from mockchain.bitcoin import Bitcoin
+        from mockchain.blockchain import Wallet
+
+        size = len(Registry.root)
+
+        for i in range(20):
+            with Registry() as registry:
+                bitcoin = Bitcoin()
+                alice = Wallet('alice')
+                tx = bitcoin.transfer(bitcoin.faucet, alice, 10)
+                bitcoin.add_transaction(tx, "transfer")
+                bitcoin.mine_block()
+
+                self.assertEqual(Cryptic.get(tx.hash), "transfer")
+                self.assertIs(Address.get(alice.address.value), alice.address)
+
+            registry.drop()
+            self.assertNotEqual(Cryptic.get(tx.hash), "transfer")
+            self.assertIsNone(Address.find(alice.address.value))
+
+        self.assertEqual(len(Registry.root), size)
+        self.assertIs(Registry.current, Registry.root)
+
+    def test_nested(self):
+        commit("outer")
+        with Registry() as outer:
+            commit("inner")
+            with Registry(name_limit=2) as inner:
+                commit("a")
+                commit("b")
+                commit("c")
+
+                self.assertEqual(Cryptic.get(hash("inner")), "h_inner")
+                self.assertEqual(Cryptic.get(hash("outer")), "h_outer")
+                self.assertEqual(Cryptic.get(hash("a")), hash("a"))
+                self.assertEqual(Cryptic.get(hash("c")), "h_c")
+
+            self.assertIs(Registry.current, outer)
+            self.assertEqual(Cryptic.get(hash("c")), hash("c"))
+
+        self.assertEqual(Cryptic.get(hash("inner")), hash("inner"))
+
+    def test_recency(self):
+        with Registry(name_limit=2):
+            commit("a")
+            commit("b")
+            self.assertEqual(Cryptic.get(hash("a")), "h_a")
+            commit("c")
+
+            self.assertEqual(Cryptic.get(hash("a")), "h_a")
+            self.assertEqual(Cryptic.get(hash("b")), hash("b"))
+
+    def test_chain_scope(self):
+        from mockchain.bitcoin import Bitcoin
+        from mockchain.blockchain import Wallet, TransactionStatus
+        from mockchain.program import Program
+
+        with Registry() as registry:
+            bitcoin = Bitcoin()
+            alice = Wallet('alice')
+            self.assertIsNot(Program.cache("results"), Program.result_cache)
+
+        self.assertIs(bitcoin.registry, registry)
+        self.assertIsNone(Address.find(alice.address.value))
+
+        tx = bitcoin.transfer(bitcoin.faucet, alice, 10)
+        bitcoin.add_transaction(tx, "late")
+        bitcoin.mine_block()
+
+        self.assertEqual(tx.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(registry.get_name(tx.hash), "late")
+        self.assertNotEqual(Cryptic.get(tx.hash), "late")
+        self.assertIs(Registry.current, Registry.root)
+
+    def test_empty_registry(self):
+        from mockchain.bitcoin import Bitcoin
+
+        registry = Registry()
+        self.assertEqual(len(registry), 0)
+        bitcoin = Bitcoin(registry=registry)
+
+        self.assertIs(bitcoin.registry, registry)
+        self.assertIs(registry.get_address(bitcoin.faucet.address.value), bitcoin.faucet.address)
+        self.assertNotIn(bitcoin.faucet.address.value, Registry.root.addresses)
+
+    def test_scenario_scope(self):
+        from mockchain.scenario import Scenario
+
+        scenario = Scenario([])
+        self.assertIsNot(scenario.registry, Registry.root)
+        self.assertIs(scenario.bitcoin.registry, scenario.registry)
+        self.assertIs(scenario.registry.get_address(scenario.alice.address.value), scenario.alice.address)
+        self.assertIs(Registry.current, Registry.root)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
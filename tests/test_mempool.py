@@ -0,0 +1,445 @@
+import unittest
+import asyncio
+from mockchain.bitcoin import Bitcoin, Output, Script
+from mockchain.cardano import Cardano, Output as CardanoOutput
+from mockchain.blockchain import Wallet, TransactionStatus
+from mockchain.mempool import Mempool
+
+
+class TestMempool(unittest.TestCase):
+    def chain(self, blockchain, alice, length):
+        txs = [blockchain.transfer(blockchain.faucet, alice, 1000)]
+        for i in range(length - 1):
+            tx = blockchain.create_transaction([txs[-1].outputs[0].hash], [Output(1000 - i - 1, Script.p2pubkey(alice))])
+            txs.append(tx)
+
+        return txs
+
+    def test_ordered(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        txs = self.chain(blockchain, alice, 5)
+
+        mempool = Mempool()
+        for tx in reversed(txs):
+            mempool.add(tx)
+
+        self.assertEqual(mempool.ordered(), txs)
+        self.assertIs(mempool.spender(txs[1].inputs[0].ptr), txs[1])
+        self.assertIs(mempool.output(txs[1].inputs[0].ptr), txs[0].outputs[0])
+
+        mempool.remove(txs[0])
+        self.assertEqual(len(mempool), 4)
+        self.assertIsNone(mempool.output(txs[1].inputs[0].ptr))
+        self.assertEqual(mempool.ordered(), txs[1:])
+
+    def test_chain_in_one_block(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        txs = self.chain(blockchain, alice, 5)
+
+        blockchain.add_transaction(txs[0])
+        for tx in txs[1:]:
+            blockchain.add_transaction(tx)
+            self.assertTrue(tx.sign(alice))
+
+        blockchain.mine_block()
+
+        self.assertEqual([tx.status for tx in txs], [TransactionStatus.CONFIRMED] * 5)
+        self.assertEqual(blockchain.blocks[-1], txs)
+        self.assertEqual(len(blockchain.mempool), 0)
+
+    def test_orphan_waits(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        parent, child = self.chain(blockchain, alice, 2)
+
+        child.inputs[0].set_witness([alice.sign(child.hash)])
+        blockchain.add_transaction(child)
+        blockchain.mine_block()
+
+        self.assertEqual(child.status, TransactionStatus.CREATED)
+        self.assertEqual(child.status_msg, "waiting for input: "+parent.outputs[0].hash)
+        self.assertEqual(len(blockchain.mempool), 1)
+
+        blockchain.add_transaction(parent)
+        blockchain.mine_block()
+
+        self.assertEqual(parent.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(child.status, TransactionStatus.CONFIRMED)
+
+        spent = blockchain.create_transaction([parent.outputs[0].hash], [Output(1000, Script.p2pubkey(bob))])
+        spent.inputs[0].set_witness([alice.sign(spent.hash)])
+        blockchain.add_transaction(spent)
+        blockchain.mine_block()
+
+        self.assertEqual(spent.status, TransactionStatus.FAILED)
+        self.assertEqual(len(blockchain.mempool), 0)
+
+    def test_parent_fails(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        txs = self.chain(blockchain, alice, 3)
+        for tx in txs:
+            blockchain.add_transaction(tx)
+            tx.sign(alice)
+
+        # spends genesis:0 from under the parent
+        self.assertTrue(blockchain.mine_transaction(blockchain.transfer(blockchain.faucet, bob, 500)))
+        blockchain.mine_block()
+
+        self.assertEqual([tx.status for tx in txs], [TransactionStatus.FAILED] * 3)
+        self.assertEqual(txs[0].status_msg, "input not found: genesis:0")
+        self.assertEqual([tx.status_msg for tx in txs[1:]], ["parent failed: "+txs[0].hash] * 2)
+        self.assertEqual(len(blockchain.mempool), 0)
+
+    def test_orphan_expires(self):
+        blockchain = Bitcoin(orphan_blocks=2)
+        alice = Wallet('alice')
+        orphan = blockchain.create_transaction(["deadbeef:0"], [Output(10, Script.p2pubkey(alice))])
+        orphan.inputs[0].set_witness([alice.sign(orphan.hash)])
+        blockchain.add_transaction(orphan)
+        child = blockchain.create_transaction([orphan.outputs[0].hash], [Output(10, Script.p2pubkey(alice))])
+        child.sign(alice)
+        blockchain.add_transaction(child)
+
+        async def run():
+            async def miner():
+                for _ in range(3):
+                    await asyncio.sleep(0)
+                    blockchain.mine_block()
+                    if len(blockchain.blocks) < 3:
+                        self.assertEqual(orphan.status_msg, "waiting for input: deadbeef:0")
+
+            result, _ = await asyncio.gather(blockchain.wait_for_transaction(orphan, max_blocks=5), miner())
+            return result
+
+        self.assertFalse(asyncio.run(run()))
+        self.assertEqual(orphan.status, TransactionStatus.FAILED)
+        self.assertEqual(orphan.status_msg, "input not found: deadbeef:0")
+        self.assertEqual(child.status, TransactionStatus.FAILED)
+        self.assertEqual(len(blockchain.mempool), 0)
+
+    def test_cardano_chain(self):
+        cardano = Cardano()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        tx1 = cardano.transfer(cardano.faucet, alice, 100)
+        tx2 = cardano.create_transaction([tx1.outputs[0].ptr], [CardanoOutput(bob, 100)])
+        tx2.sign(alice)
+        tx3 = cardano.create_transaction([tx2.outputs[0].ptr], [CardanoOutput(alice, 100)])
+        tx3.sign(bob)
+
+        for tx in [tx3, tx2, tx1]:
+            cardano.add_transaction(tx)
+        cardano.mine_block()
+
+        self.assertEqual([tx.status for tx in [tx1, tx2, tx3]], [TransactionStatus.CONFIRMED] * 3)
+        self.assertEqual(cardano.blocks[-1], [tx1, tx2, tx3])
+
+    def test_admission(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        parent, child = self.chain(blockchain, alice, 2)
+        ptr = parent.outputs[0].hash
+
+        self.assertTrue(blockchain.add_transaction(parent))
+        self.assertTrue(blockchain.add_transaction(child))
+        child.inputs[0].set_witness([alice.sign(child.hash)])
+
+        duplicate = blockchain.create_transaction([ptr, ptr], [Output(1000, Script.p2pubkey(bob))])
+        self.assertFalse(blockchain.add_transaction(duplicate))
+        self.assertEqual(duplicate.status_msg, "duplicate input: "+ptr)
+
+        missing = blockchain.create_transaction([parent.hash+":5"], [Output(1000, Script.p2pubkey(bob))])
+        self.assertFalse(blockchain.add_transaction(missing))
+        self.assertEqual(missing.status_msg, "input not found: "+parent.hash+":5")
+
+        conflict = blockchain.create_transaction([ptr], [Output(1000, Script.p2pubkey(bob))])
+        conflict.inputs[0].set_witness([alice.sign(conflict.hash)])
+        self.assertFalse(blockchain.add_transaction(conflict))
+        self.assertEqual(conflict.status, TransactionStatus.FAILED)
+        self.assertEqual(conflict.status_msg, "conflicts with "+child.hash)
+        self.assertNotIn(conflict, blockchain.mempool)
+
+        replacement = blockchain.create_transaction([ptr], [Output(998, Script.p2pubkey(bob))])
+        replacement.inputs[0].set_witness([alice.sign(replacement.hash)])
+        self.assertTrue(blockchain.add_transaction(replacement, replace=True))
+        self.assertEqual(child.status, TransactionStatus.FAILED)
+        self.assertEqual(child.status_msg, "replaced by "+replacement.hash)
+        self.assertIs(blockchain.mempool.spender(ptr), replacement)
+
+        blockchain.mine_block()
+        self.assertEqual(replacement.status, TransactionStatus.CONFIRMED)
+
+        spent = blockchain.create_transaction([ptr], [Output(1000, Script.p2pubkey(alice))])
+        self.assertFalse(blockchain.add_transaction(spent))
+        self.assertEqual(spent.status_msg, "input not found: "+ptr)
+        self.assertFalse(blockchain.add_transaction(replacement))
+        self.assertEqual(replacement.status_msg, "already mined")
+
+    def test_admission_witnesses(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        forged = blockchain.create_transaction(["genesis:0"], [Output(1000, Script.p2pubkey(bob))])
+        forged.inputs[0].set_witness([bob.sign(forged.hash)])
+        self.assertFalse(blockchain.add_transaction(forged))
+        self.assertEqual(forged.status, TransactionStatus.FAILED)
+        self.assertEqual(forged.status_msg, "invalid witness for input: genesis:0")
+
+        # still failed, not admitted with that status
+        self.assertFalse(blockchain.add_transaction(forged))
+        self.assertNotIn(forged, blockchain.mempool)
+
+        # unsigned is fine, the signature can come later
+        tx = blockchain.create_transaction(["genesis:0"], [Output(1000, Script.p2pubkey(bob))])
+        self.assertTrue(blockchain.add_transaction(tx))
+        tx.sign(blockchain.faucet)
+        blockchain.mine_block()
+        self.assertEqual(tx.status, TransactionStatus.CONFIRMED)
+
+        cardano = Cardano()
+        tx = cardano.transfer(cardano.faucet, alice, 100)
+        tx.signatures[0] = alice.sign(tx.hash)
+        self.assertFalse(cardano.add_transaction(tx))
+        self.assertEqual(tx.status_msg, "invalid signature")
+
+    def test_duplicate(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+
+        tx1 = blockchain.transfer(blockchain.faucet, alice, 100)
+        tx2 = blockchain.transfer(blockchain.faucet, alice, 100)
+        self.assertEqual(tx1.hash, tx2.hash)
+        self.assertIsNot(tx1, tx2)
+
+        self.assertTrue(blockchain.add_transaction(tx1))
+        self.assertTrue(blockchain.add_transaction(tx1))
+        self.assertFalse(blockchain.add_transaction(tx2))
+        self.assertEqual(tx2.status, TransactionStatus.FAILED)
+        self.assertEqual(tx2.status_msg, "already pending: "+tx1.hash)
+        self.assertIs(blockchain.get_transaction(tx1.hash), tx1)
+        self.assertFalse(asyncio.run(blockchain.wait_for_transaction(tx2)))
+
+        blockchain.mine_block()
+        self.assertEqual(tx1.status, TransactionStatus.CONFIRMED)
+        self.assertIs(blockchain.get_transaction(tx1.hash), tx1)
+
+    def test_template(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        parent, child = self.chain(blockchain, alice, 2)
+        x = blockchain.create_transaction(["x:0"], [Output(1, Script.p2pubkey(alice))])
+        y = blockchain.create_transaction(["y:0"], [Output(2, Script.p2pubkey(alice))])
+        fees = {parent.hash: 0, child.hash: 10, x.hash: 4, y.hash: 1}
+
+        mempool = Mempool()
+        for tx in [y, child, x, parent]:
+            mempool.add(tx)
+
+        def template(limit, exclude=()):
+            return mempool.template(limit, lambda tx: 10, lambda tx: fees[tx.hash], exclude)
+
+        self.assertEqual(template(30), [parent, child, x])
+        self.assertEqual(template(25), [parent, child])
+        self.assertEqual(template(15), [x])
+        self.assertEqual(template(100, [parent]), [y, x])
+        self.assertEqual(len(mempool), 4)
+
+    def spends(self, blockchain, alice, bob, fees):
+        outputs = [Output(100, Script.p2pubkey(alice)) for _ in fees]
+        funding = blockchain.create_transaction(["genesis:0"], outputs + [Output(blockchain.supply - 100 * len(fees), Script.p2pubkey(blockchain.faucet))])
+        funding.sign(blockchain.faucet)
+        blockchain.add_transaction(funding)
+        blockchain.mine_block()
+
+        txs = []
+        for output, fee in zip(funding.outputs, fees):
+            tx = blockchain.create_transaction([output.hash], [Output(100 - fee, Script.p2pubkey(bob))])
+            tx.sign(alice)
+            txs.append(tx)
+
+        return txs
+
+    def test_block_size(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        txs = self.spends(blockchain, alice, bob, [1, 5, 3, 2])
+
+        self.assertEqual([blockchain.fee(tx) for tx in txs], [1, 5, 3, 2])
+
+        # the spends are the same shape, so the same size: room for two of them
+        self.assertEqual(len({tx.size() for tx in txs}), 1)
+        blockchain.block_size = 2 * txs[0].size()
+        for tx in txs:
+            blockchain.add_transaction(tx)
+
+        blockchain.mine_block()
+        self.assertEqual(blockchain.blocks[-1], [txs[1], txs[2]])
+        self.assertEqual(len(blockchain.mempool), 2)
+
+        blockchain.mine_block()
+        self.assertEqual(blockchain.blocks[-1], [txs[0], txs[3]])
+        self.assertEqual([tx.status for tx in txs], [TransactionStatus.CONFIRMED] * 4)
+
+        tx = blockchain.transfer(bob, alice, 50, fee=7)
+        self.assertEqual(blockchain.fee(tx), 7)
+
+    def test_miner_fees(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        carol = Wallet('carol')
+        txs = self.spends(blockchain, alice, bob, [1, 5])
+        for tx in txs:
+            blockchain.add_transaction(tx)
+
+        supply = blockchain.supply
+        blockchain.mine_block(miner=carol)
+
+        coinbase = blockchain.blocks[-1][0]
+        self.assertEqual(blockchain.blocks[-1][1:], txs)
+        self.assertEqual([tx.txnum for tx in blockchain.blocks[-1]], [0, 1, 2])
+        self.assertEqual(coinbase.outputs[0].amount, blockchain.block_reward + 6)
+        self.assertEqual(len(coinbase.outputs), 1)
+        self.assertEqual(sum(end - start for start, end in coinbase.outputs[0].ordinals), blockchain.block_reward + 6)
+        self.assertEqual(blockchain.supply, supply + blockchain.block_reward)
+        self.assertEqual([len(tx.outputs) for tx in txs], [1, 1])
+        self.assertEqual(blockchain.fees, 0)
+
+    def test_burned_fees(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        txs = self.spends(blockchain, alice, bob, [1, 5])
+        for tx in txs:
+            blockchain.add_transaction(tx)
+
+        faucet = sum(blockchain.utxo_set[ptr].amount for ptr in blockchain.UTXOs_for_address(blockchain.faucet))
+        total = sum(output.amount for output in blockchain.utxo_set.values())
+        blockchain.mine_block()
+
+        # no coinbase and no change for the faucet, the 6 in fees are gone
+        self.assertEqual(blockchain.blocks[-1], txs)
+        self.assertEqual([len(tx.outputs) for tx in txs], [1, 1])
+        self.assertEqual(sum(blockchain.utxo_set[ptr].amount for ptr in blockchain.UTXOs_for_address(blockchain.faucet)), faucet)
+        self.assertEqual(sum(output.amount for output in blockchain.utxo_set.values()), total - 6)
+        self.assertEqual(blockchain.fees, 0)
+        self.assertEqual(blockchain.fee_ordinals, [])
+
+    def test_eviction(self):
+        blockchain = Bitcoin(mempool_count=2)
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        txs = self.spends(blockchain, alice, bob, [3, 1, 5, 1])
+
+        self.assertTrue(blockchain.add_transaction(txs[0]))
+        self.assertTrue(blockchain.add_transaction(txs[1]))
+        self.assertTrue(blockchain.add_transaction(txs[2]))
+        self.assertEqual(txs[1].status, TransactionStatus.EVICTED)
+        self.assertEqual(txs[1].status_msg, "evicted: mempool full")
+
+        self.assertFalse(blockchain.add_transaction(txs[3]))
+        self.assertEqual(txs[3].status, TransactionStatus.EVICTED)
+        self.assertEqual(blockchain.evictions, 2)
+        self.assertEqual(blockchain.evicted_size, txs[1].size() + txs[3].size())
+        self.assertFalse(asyncio.run(blockchain.wait_for_transaction(txs[3])))
+
+        blockchain.mine_block()
+        self.assertEqual(blockchain.blocks[-1], [txs[0], txs[2]])
+
+        self.assertTrue(blockchain.add_transaction(txs[1]))
+        self.assertEqual(txs[1].status, TransactionStatus.SIGNED)
+        blockchain.mine_block()
+        self.assertEqual(txs[1].status, TransactionStatus.CONFIRMED)
+
+    def test_eviction_held(self):
+        blockchain = Bitcoin(mempool_count=2)
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        outputs = [Output(100, Script.p2timelock(3, bob)), Output(100, Script.p2timelock(3, bob)), Output(100, Script.p2pubkey(alice))]
+        funding = blockchain.create_transaction(["genesis:0"], outputs + [Output(blockchain.supply - 300, Script.p2pubkey(blockchain.faucet))])
+        funding.sign(blockchain.faucet)
+        blockchain.add_transaction(funding)
+        blockchain.mine_block()
+
+        held = []
+        for output, fee in zip(outputs[:2], [3, 5]):
+            tx = blockchain.create_transaction([output.hash], [Output(100 - fee, Script.p2pubkey(alice))])
+            tx.inputs[0].set_witness([bob.sign(tx.hash)])
+            self.assertTrue(blockchain.add_transaction(tx))
+            held.append(tx)
+
+        self.assertEqual(len(blockchain.held), 2)
+        self.assertEqual(len(blockchain.mempool), 0)
+
+        tx = blockchain.create_transaction([outputs[2].hash], [Output(96, Script.p2pubkey(bob))])
+        tx.sign(alice)
+        self.assertTrue(blockchain.add_transaction(tx))
+
+        # the held ones count too, the cheapest of all three goes
+        self.assertEqual(held[0].status, TransactionStatus.EVICTED)
+        self.assertEqual(list(blockchain.held), [held[1]])
+        self.assertEqual(list(blockchain.mempool), [tx])
+        self.assertIsNone(blockchain.spender(outputs[0].hash))
+
+        blockchain.mine_block(3)
+        self.assertEqual([t.status for t in held + [tx]], [TransactionStatus.EVICTED, TransactionStatus.CONFIRMED, TransactionStatus.CONFIRMED])
+        self.assertEqual(len(blockchain.timelocked), 0)
+
+        self.assertTrue(blockchain.add_transaction(held[0]))
+        blockchain.mine_block()
+        self.assertEqual(held[0].status, TransactionStatus.CONFIRMED)
+
+    def test_eviction_size(self):
+        blockchain = Bitcoin()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+        other = self.spends(blockchain, alice, bob, [2])[0]
+        parent, child = self.chain(blockchain, alice, 2)
+        child.inputs[0].set_witness([alice.sign(child.hash)])
+
+        blockchain.mempool_size = parent.size() + child.size()
+        blockchain.add_transaction(parent)
+        blockchain.add_transaction(child)
+        self.assertEqual(blockchain.mempool.size, parent.size() + child.size())
+
+        blockchain.add_transaction(other)
+        self.assertEqual([tx.status for tx in [parent, child]], [TransactionStatus.EVICTED] * 2)
+        self.assertEqual(blockchain.evictions, 2)
+        self.assertEqual(list(blockchain.mempool), [other])
+        self.assertEqual(blockchain.mempool.size, other.size())
+
+        mempool = Mempool()
+        for tx, rate in [(parent, 1), (child, 0.5), (other, 0.5)]:
+            mempool.add(tx, 10, rate)
+        self.assertIs(mempool.lowest(), child)
+        mempool.remove(child)
+        self.assertIs(mempool.lowest(), other)
+
+    def test_cardano_conflict(self):
+        cardano = Cardano()
+        alice = Wallet('alice')
+        bob = Wallet('bob')
+
+        tx1 = cardano.transfer(cardano.faucet, alice, 100)
+        tx2 = cardano.transfer(cardano.faucet, bob, 100)
+        self.assertTrue(cardano.add_transaction(tx1))
+        self.assertFalse(cardano.add_transaction(tx2))
+        self.assertEqual(tx2.status_msg, "conflicts with "+tx1.hash)
+
+        cardano.mine_block()
+        self.assertEqual(tx1.status, TransactionStatus.CONFIRMED)
+        self.assertEqual(len(cardano.blocks[-1]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from mockchain.crypto import hash
+from mockchain.merkle import MerkleTree, bisect, serve_trace, challenge, hash_leaf, hash_node
+from mockchain.program import Program
+from mockchain.scenario import Agent, Scenario
+
+
+def collatz(n):
+    steps = 0
+    while n != 1:
+        if n % 2 == 0:
+            n = n // 2
+        else:
+            n = 3 * n + 1
+        steps += increment
+    return steps
+
+
+class TestMerkleTree(unittest.TestCase):
+    def test_proofs(self):
+        for count in [1, 2, 7, 16, 33]:
+            leaves = [hash(str(i)) for i in range(count)]
+            tree = MerkleTree(leaves)
+
+            for i in range(count):
+                self.assertTrue(MerkleTree.verify(tree.root, leaves[i], tree.proof(i)))
+
+            self.assertFalse(MerkleTree.verify(tree.root, hash("other"), tree.proof(count-1)))
+
+    def test_root(self):
+        leaves = [hash(str(i)) for i in range(3)]
+        tree = MerkleTree(leaves)
+
+        self.assertEqual(tree.root, hash_node(hash_node(hash_leaf(leaves[0]), hash_leaf(leaves[1])), hash_leaf(leaves[2])))
+        self.assertEqual(MerkleTree([leaves[0]]).root, hash_leaf(leaves[0]))
+
+    def test_second_preimage(self):
+        leaves = [hash(str(i)) for i in range(4)]
+        tree = MerkleTree(leaves)
+        forged = tree.node(1, 0)
+
+        self.assertFalse(MerkleTree.verify(tree.root, forged, [(tree.node(1, 1), False)]))
+
+
+class TestBisection(unittest.IsolatedAsyncioTestCase):
+    async def test_bisect(self):
+        leaves = [hash(str(i)) for i in range(1000)]
+
+        for divergence in [0, 1, 511, 512, 999, None]:
+            other = list(leaves)
+            if divergence is not None:
+                for i in range(divergence, len(other)):
+                    other[i] = hash("x"+str(i))
+
+            remote = MerkleTree(other)
+            queries = 0
+
+            async def query(kind, *args):
+                nonlocal queries
+                queries += 1
+                if kind == "length":
+                    return len(remote)
+                return remote.node(*args)
+
+            self.assertEqual(await bisect(MerkleTree(leaves), query), divergence)
+            self.assertLessEqual(queries, 2 + MerkleTree(leaves).depth)
+
+    async def test_bisect_lengths(self):
+        leaves = [hash(str(i)) for i in range(1000)]
+
+        for length, divergence, expected in [(700, None, 700), (1000, None, None), (1300, None, 1000), (600, 300, 300), (1200, 999, 999), (1, None, 1), (0, None, 0)]:
+            other = [hash(str(i)) for i in range(length)]
+            if divergence is not None:
+                other[divergence] = hash("x")
+
+            remote = MerkleTree(other)
+
+            async def query(kind, *args):
+                if kind == "length":
+                    return len(remote)
+                return remote.node(*args)
+
+            self.assertEqual(await bisect(MerkleTree(leaves), query), expected)
+
+
+class Verifier(Agent):
+    async def setup(self, scenario):
+        self.tree = Program.address(collatz, increment=1).program.trace_tree(27)
+        serve_trace(self, "trace", self.tree)
+
+
+class Challenger(Agent):
+    async def run(self, scenario):
+        program = Program.address(collatz, increment=2).program
+        self.tree = program.trace_tree(27)
+        self.step = await challenge(self, "verifier", "trace", self.tree)
+        self.proof = await self.send("verifier", "trace", "proof", self.step)
+        self.leaf = await self.send("verifier", "trace", "leaf", self.step)
+        self.remote_root = await self.send("verifier", "trace", "node", self.tree.depth, 0)
+
+
+class TestDispute(unittest.TestCase):
+    def test_scenario(self):
+        verifier = Verifier("verifier")
+        challenger = Challenger("challenger")
+        scenario = Scenario([verifier, challenger])
+        result = scenario.execute(block_time=0, block_limit=None)
+
+        self.assertTrue(result)
+
+        step = challenger.step
+        hashes, trace = Program.address(collatz, increment=1).program.trace(27)
+        self.assertEqual(verifier.tree.leaves[step], hashes[step])
+        self.assertEqual(verifier.tree.leaves[:step], challenger.tree.leaves[:step])
+        self.assertNotEqual(verifier.tree.leaves[step], challenger.tree.leaves[step])
+        self.assertTrue(MerkleTree.verify(challenger.remote_root, challenger.leaf, challenger.proof))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,15 @@
 import unittest
-from mockchain.program import Program
+import contextlib
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
+from mockchain.program import Program, load_program
+from mockchain.tracing import Tracer, Meter, BudgetExceeded, HashFile, env_to_string
+from mockchain.crypto import hash, Address
 from typing import List
 
 
@@ -46,6 +56,38 @@ class TestProgram(unittest.TestCase):
         self.assertEqual(h3.program.run(), 21)
         self.assertEqual(h4.program.run(10,20), 30)
         
+    def test_isolation(self):
+        def counter():
+            global total
+            total = total + 1
+            return increment()
+
+        def increment():
+            global total
+            total = total + 10
+            seen.append(total)
+            return total
+
+        h1 = Program.address(counter, increment, total=0, seen=[])
+
+        self.assertEqual(h1.program.run(), 11)
+        self.assertEqual(h1.program.run(), 11)
+        self.assertEqual(h1.program.globals["total"], 0)
+        self.assertEqual(h1.program.cnt, 2)
+
+    def test_mutable_defaults(self):
+        def append(x):
+            return push(x)
+
+        def push(x, items=[]):
+            items.append(x)
+            return len(items)
+
+        h1 = Program.address(append, push)
+
+        self.assertEqual(h1.program.run(1), 1)
+        self.assertEqual(h1.program.run(2), 1)
+
     def test_raise(self):
         def f1():
             raise Exception("error")
@@ -62,5 +104,309 @@ class TestProgram(unittest.TestCase):
         with self.assertRaises(Exception):
             h1 = Program.address(f1)
 
+    def test_code_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            default = Program.cache_dir
+            Program.cache_dir = cache_dir
+            try:
+                p1 = Program("def f1(a):\n    return a * 3\n", "f1", "cachedcode", {})
+                self.assertIn("cachedcode.py", os.listdir(cache_dir))
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+                with mock.patch("code.compile_command") as compile_command:
+                    p2 = Program("def f1(a):\n    return a * 3\n", "f1", "cachedcode", {})
+                    self.assertFalse(compile_command.called)
+
+                self.assertEqual(p2.run(5), 15)
+                self.assertEqual(p2.compiled_code.co_filename, p1.compiled_code.co_filename)
+            finally:
+                Program.cache_dir = default
+
+    def test_env_to_string(self):
+        self.assertEqual(env_to_string({}), "}")
+        self.assertEqual(env_to_string({"a": 1, "b": "x", "c": len, "d": [1]}), "{a:1, b:'x', c:<function>, d:[1]}")
+
+    def test_trace(self):
+        def f1(n):
+            total = 0
+            for i in range(n):
+                total += i
+            return total
+
+        h1 = Program.address(f1)
+        hash_trace, trace = h1.program.trace(3)
+
+        self.assertEqual(trace[0], "#2 {n:3}")
+        self.assertEqual(trace[-1], "Return: 3")
+        self.assertEqual(hash_trace, [hash(x) for x in trace])
+        self.assertEqual(h1.program.step[hash_trace[0]], hash_trace[1])
+
+        tracer = Tracer("hash")
+        self.assertEqual(h1.program.run_traced(tracer, 3), 3)
+        self.assertEqual(tracer.hashes, hash_trace)
+        self.assertIsNone(tracer.text)
+
+        tracer = Tracer("sample", sample=4, backend="settrace")
+        h1.program.run_traced(tracer, 3)
+        self.assertEqual(tracer.hashes, hash_trace)
+        self.assertEqual(tracer.samples, {0: trace[0], 4: trace[4], 8: trace[8]})
+
+    @unittest.skipUnless(hasattr(sys, "monitoring"), "sys.monitoring needs Python 3.12+")
+    def test_monitoring_parity(self):
+        def loops(n):
+            total = 0
+            for i in range(n): total += i
+            while n: n -= 1
+            return total
+
+        h1 = Program.address(loops)
+        settrace = Tracer("full", backend="settrace")
+        monitoring = Tracer("full", backend="monitoring")
+        h1.program.run_traced(settrace, 5)
+        h1.program.run_traced(monitoring, 5)
+
+        self.assertEqual(monitoring.text, settrace.text)
+        self.assertEqual(monitoring.hashes, settrace.hashes)
+        self.assertEqual(Tracer().backend, "settrace")
+
+    def test_source_cache(self):
+        def make():
+            def policy(redeemer, context):
+                return owner == redeemer
+            return policy
+
+        a1 = Program.address(make(), owner="alice")
+
+        with mock.patch("inspect.getsource", side_effect=AssertionError("source not memoized")):
+            self.assertIs(Program.address(make(), owner="alice"), a1)
+            a2 = Program.address(make(), owner="bob")
+
+        self.assertNotEqual(a1.value, a2.value)
+        self.assertTrue(a2.program.run("bob", None))
+        self.assertFalse(a2.program.run("alice", None))
+
+    def test_load_program(self):
+        source = "def loaded(redeemer, context):\n    return redeemer == 7\n"
+        program = load_program(source, "loaded", "loaded-codehash", {})
+
+        self.assertTrue(program.run(7, None))
+        self.assertIsNone(Address.find("loaded-codehash"))
+        self.assertIs(load_program(source, "loaded", "loaded-codehash", {}), program)
+
+    def test_budget(self):
+        def spin(n):
+            while True:
+                try:
+                    n += 1
+                except Exception:
+                    pass
+
+        def count(n):
+            total = 0
+            for i in range(n):
+                total += i
+            return total
+
+        p1 = Program.address(spin).program
+        p1.budget = 1000
+        with self.assertRaises(BudgetExceeded):
+            p1.run(0)
+
+        p2 = Program.address(count).program
+        meter = Meter(100)
+        self.assertEqual(p2.run_metered(meter, 10), 45)
+        self.assertEqual(meter.units[p2.codehash], 23)
+        self.assertEqual(meter.remaining(), 77)
+
+        with self.assertRaises(BudgetExceeded):
+            p2.run_metered(meter, 100)
+        self.assertEqual(meter.total, 101)
+        self.assertEqual(p2.run(100), 4950)
+
+    def test_budget_unescapable(self):
+        def spin(n):
+            while True:
+                try:
+                    while True:
+                        try:
+                            n += 1
+                        except Exception:
+                            pass
+                except Exception:
+                    pass
+
+        p = Program.address(spin).program
+        p.budget = 1000
+        errors = []
+
+        def run():
+            try:
+                p.run(0)
+            except BudgetExceeded as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+
+        def swallow1(n):
+            while True:
+                try:
+                    n += 1
+                except BaseException:
+                    pass
+
+        def swallow2(n):
+            while True:
+                try:
+                    n += 1
+                except:
+                    pass
+
+        def swallow3(n):
+            while True:
+                try:
+                    n += 1
+                finally:
+                    continue
+
+        def swallow4(n):
+            caught = (Exception, ValueError)[n]
+            try:
+                return n
+            except caught:
+                pass
+
+        def swallow5(n):
+            class Suppress:
+                def __enter__(self):
+                    return self
+                def __exit__(self, *args):
+                    return True
+
+            with Suppress():
+                return n
+
+        def swallow6(n):
+            try:
+                return n
+            except E:
+                pass
+
+        def swallow7(n):
+            with suppress(BaseException):
+                while True:
+                    n += 1
+
+        def parse(text):
+            try:
+                return json.loads(text)
+            except json.JSONDecodeError:
+                return None
+
+        # fine without a budget, refused under one
+        self.assertEqual(Program.address(swallow4).program.run(0), 0)
+        self.assertEqual(Program.address(swallow5).program.run(3), 3)
+        self.assertEqual(Program.address(swallow6, E=BaseException).program.run(3), 3)
+
+        programs = [Program.address(f).program for f in (swallow1, swallow2, swallow3, swallow4, swallow5)]
+        programs.append(Program.address(swallow6, E=BaseException).program)
+        programs.append(Program.address(swallow7, suppress=contextlib.suppress).program)
+        for program in programs:
+            program.budget = 1000
+            with self.assertRaises(BudgetExceeded):
+                program.run(0)
+
+        with self.assertRaises(BudgetExceeded):
+            Program.address(swallow5).program.run_metered(Meter(1000), 3)
+
+        program = Program.address(swallow6, E=ValueError).program
+        program.budget = 1000
+        self.assertEqual(program.run(3), 3)
+
+        program = Program.address(parse, json=json).program
+        program.budget = 1000
+        self.assertEqual(program.run("[1]"), [1])
+        self.assertIsNone(program.run("["))
+
+    def test_trace_foreign_frames(self):
+        class Noisy:
+            def __del__(self):
+                self.done = True
+
+        def f1(n):
+            total = 0
+            for i in range(n):
+                total += i
+            collect()
+            return total
+
+        def garbage():
+            # a cycle, so only the collector can run its finalizers
+            a, b = Noisy(), Noisy()
+            a.other, b.other = b, a
+
+        h1 = Program.address(f1, collect=gc.collect)
+        quiet, _ = h1.program.trace(5)
+
+        garbage()
+        tracer = Tracer("hash")
+        h1.program.run_traced(tracer, 5)
+        self.assertEqual(tracer.hashes, quiet)
+
+        previous = lambda frame, event, arg: None
+        sys.settrace(previous)
+        try:
+            h1.program.run_traced(Tracer("hash"), 5)
+            self.assertIs(sys.gettrace(), previous)
+        finally:
+            sys.settrace(None)
+
+    def test_stream_trace(self):
+        def f1(n):
+            total = 0
+            for i in range(n):
+                total += i
+            return total
+
+        h1 = Program.address(f1)
+        hash_trace, trace = h1.program.trace(2000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "f1.trace")
+            steps = len(h1.program.step)
+
+            with h1.program.stream_trace(filename, 2000) as store:
+                self.assertEqual(len(store), len(hash_trace))
+                self.assertEqual(store[0], hash_trace[0])
+                self.assertEqual(store[-1], hash_trace[-1])
+                self.assertEqual(store[3001], hash_trace[3001])
+                self.assertEqual(list(store), hash_trace)
+                self.assertEqual(len(h1.program.step), steps)
+
+            with HashFile(filename) as store:
+                self.assertEqual(len(store), len(hash_trace))
+                self.assertEqual(store[1234], hash_trace[1234])
+                with self.assertRaises(IndexError):
+                    store[len(hash_trace)]
+
+            with h1.program.stream_trace(filename, 2000) as store:
+                self.assertEqual(len(store), len(hash_trace))
+
+            def fail(n):
+                for i in range(n):
+                    pass
+                raise ValueError("fail")
+
+            with mock.patch("mockchain.tracing.HashFile.close", autospec=True, side_effect=HashFile.close) as close:
+                with self.assertRaises(ValueError):
+                    Program.address(fail).program.stream_trace(filename, 3)
+                self.assertEqual(close.call_count, 1)
 
-      
\ No newline at end of file
+        store = HashFile()
+        store.append(hash_trace[0])
+        self.assertTrue(os.path.exists(store.filename))
+        store.close()
+        self.assertFalse(os.path.exists(store.filename))
@@ -1,6 +1,34 @@
 import unittest
 from asyncio import gather, sleep, Future, Event, run
 from mockchain.scenario import Agent, Scenario
+from mockchain.cardano import Cardano, ScriptContext, ScriptPurpose, Value, Output
+from mockchain.blockchain import TransactionStatus
+from mockchain.program import Program
+
+minting_address = ""
+
+def nft_policy(redeemers, context : ScriptContext):
+    if context.purpose != ScriptPurpose.Minting:
+        return False
+
+    tx = context.txinfo
+    mint = tx.mint[context.policy]
+
+    minting = False
+    for token in mint:
+        if token.startswith("-"):
+            if mint[token] == 1:
+                original_token = token[1:]
+                if original_token not in mint or mint[original_token] != -1:
+                    return False
+        else:
+            if mint[token] == 1:
+                minting = True
+
+    if minting and minting_address not in tx.signatories:
+        return False
+
+    return True
 
 async def agent0(scenario):
     bitcoin = scenario.bitcoin
@@ -71,7 +99,41 @@ class Agent5(Agent):
         self.signal.set() 
         return 42
 
+class NFTAgent(Agent):
+    async def setup(self, scenario):
+        # registered in the scenario's scope, the chain was built outside it
+        self.policy1 = Program.address(nft_policy, minting_address=scenario.alice.address)
+        self.policy2 = Program.address(nft_policy, minting_address=scenario.bob.address)
+
+    async def run(self, scenario):
+        txs = []
+        for policy, token, signer in [(self.policy1, "NFT1", scenario.alice), (self.policy2, "NFT2", scenario.bob), (self.policy1, "NFT3", scenario.bob)]:
+            tx = self.cardano.create_mint_transaction(Value.Token(policy, token, 1), scenario.carol)
+            tx.sign(signer)
+            self.cardano.add_transaction(tx)
+            txs.append(tx)
+
+        for tx in txs:
+            await self.cardano.wait_for_transaction(tx)
+
+        burn = Value.Token(self.policy1, "-NFT1", 1)+Value.Token(self.policy1, "NFT1", -1)
+        tx = self.cardano.create_transaction([txs[0].outputs[0].ptr], [Output(scenario.carol, Value.Token(self.policy1, "-NFT1", 1))], mint=burn)
+        tx.sign(scenario.carol)
+        self.cardano.add_transaction(tx)
+        await self.cardano.wait_for_transaction(tx)
+
+        self.txs = txs + [tx]
+
+
 class TestScenario(unittest.TestCase):
+    def test_nft(self):
+        agent = NFTAgent()
+        scenario = Scenario([agent], [Cardano()])
+        self.assertTrue(scenario.execute(block_time=0, block_limit=50))
+
+        self.assertIs(scenario.cardano.registry, scenario.registry)
+        self.assertEqual([tx.status for tx in agent.txs], [TransactionStatus.CONFIRMED, TransactionStatus.CONFIRMED, TransactionStatus.FAILED, TransactionStatus.CONFIRMED])
+
     def test_blockchains(self):
         scenario = Scenario([agent0, Agent1()])
         result = scenario.execute(block_time=0, block_limit=50)